@@ -0,0 +1,267 @@
+'''Benchmark training and generation hot paths of the name generator.
+
+Training is measured in tokens/sec for every cell type, batch size and hidden
+size on synthetic and real names, generation in latency percentiles and
+names/sec for single and batched requests. Results are written as JSON and
+can be compared against a stored baseline, exit code is 1 on regression.
+
+    python bench.py --out ./models/bench.json
+    python bench.py --quick --baseline ./models/bench.json --out ./models/bench_new.json --tolerance 0.1
+'''
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import numpy as np
+import torch
+from torch import nn
+from torch.optim import Adam
+from constant import DATA_PATH, DEVICE, EMB_SIZE, GRAD_CLIP, VOCAB_PATH
+from vocab import Vocab, load_vocab
+from dataloader import load_data, compile_data, pad_codes
+from train import compute_loss, batch_tokens
+from inference import generate, generate_batch
+from network import RNNNameGenerator, LSTMNameGenerator, GRUNameGenerator
+
+NETWORKS = {'RNN': RNNNameGenerator, 'LSTM': LSTMNameGenerator, 'GRU': GRUNameGenerator}
+
+# benchmark grid
+GRID = {
+    'cell': ['RNN', 'LSTM', 'GRU'],
+    'batch_size': [64, 256],
+    'hid_size': [128, 256],
+    'data': ['synthetic', 'real']
+}
+QUICK_GRID = {
+    'cell': ['LSTM'],
+    'batch_size': [64],
+    'hid_size': [128],
+    'data': ['synthetic']
+}
+
+def percentile_ms(seconds, q):
+    return float(np.percentile(seconds, q) * 1000)
+
+def timings(fn, repeat, warmup):
+    # run fn repeat times after warmup, return seconds of every run
+    for _ in range(warmup):
+        fn()
+
+    seconds = []
+    for _ in range(repeat):
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        fn()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        seconds.append(time.perf_counter() - start)
+
+    return seconds
+
+def rss_mb():
+    # current resident memory of this process, None without /proc (not Linux)
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+def memory_start():
+    # memory before a configuration, the process peak would include earlier configurations
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+        return rss_mb(), torch.cuda.memory_allocated()
+    return rss_mb(), None
+
+def memory(start):
+    '''Memory a configuration added since memory_start(): growth of current
+    RSS while its model and batches are alive, and peak cuda memory above what
+    was allocated before. RSS freed by earlier configurations may be reused,
+    so the delta is a lower bound.'''
+
+    rss, cuda = start
+    current = rss_mb()
+    result = {'rss_delta_mb': current - rss if current is not None and rss is not None else None}
+    if cuda is not None:
+        result['cuda_peak_delta_mb'] = (torch.cuda.max_memory_allocated() - cuda) / 2**20
+    return result
+
+def load_features(vocab, data, rng):
+    '''Right padded features of real names, or random names with
+    the same length distribution if data is synthetic.'''
+
+    codes, offsets = compile_data(DATA_PATH, vocab)
+    if data == 'real':
+        return pad_codes(codes, offsets)
+
+    lengths = rng.choice(np.diff(offsets), size=len(offsets) - 1)
+    codes = rng.integers(1, len(vocab), size=lengths.sum())
+    return pad_codes(codes, np.concatenate(([0], np.cumsum(lengths))))
+
+def bench_train(vocab, cell, batch_size, hid_size, data, packed=False, steps=30, warmup=5, seed=0):
+    '''Train steps per second and tokens per second of one configuration,
+    batches are prepared beforehand so only the training step is measured.'''
+
+    start = memory_start()
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    features = load_features(vocab, data, rng)
+
+    # batches sampled beforehand, one per step
+    batches = []
+    for _ in range(warmup + steps):
+        feature = torch.from_numpy(features[rng.choice(len(features), batch_size)])
+        batches.append((feature, (feature != 0).sum(dim=1)) if packed else (feature,))
+
+    model = NETWORKS[cell](len(vocab), hid_size, EMB_SIZE, char2int=vocab, int2char=vocab.int2char).to(DEVICE)
+    model.train()
+    optim = Adam(model.parameters(), lr=1e-3)
+    criterion = nn.CrossEntropyLoss()
+
+    batch_iter = iter(batches)
+    def step():
+        batch = next(batch_iter)
+        optim.zero_grad()
+        loss = compute_loss(model, batch, criterion)
+        loss.backward()
+        nn.utils.clip_grad_norm_(model.parameters(), GRAD_CLIP)
+        optim.step()
+
+    seconds = timings(step, steps, warmup)
+    tokens = sum(batch_tokens(b) for b in batches[warmup:])
+
+    return {
+        'tokens_per_sec': tokens / sum(seconds),
+        'step_p50_ms': percentile_ms(seconds, 50),
+        'step_p99_ms': percentile_ms(seconds, 99),
+        **memory(start)
+    }
+
+def bench_generate(vocab, cell, hid_size, batch_size, max_length=10, repeat=50, warmup=5, seed=0):
+    '''Latency and names per second of generating batch_size names,
+    batch_size 1 goes through generate() like a single request.'''
+
+    start = memory_start()
+    torch.manual_seed(seed)
+    model = NETWORKS[cell](len(vocab), hid_size, EMB_SIZE, char2int=vocab, int2char=vocab.int2char).to(DEVICE)
+    model.eval()
+
+    # greedy decoding is deterministic, so every run does the same work
+    if batch_size == 1:
+        fn = lambda: generate(model, vocab, 'A', max_length, greedy=True)
+    else:
+        fn = lambda: generate_batch(model, vocab, 'A', max_length, greedy=True, n=batch_size)
+
+    seconds = timings(fn, repeat, warmup)
+
+    return {
+        'p50_ms': percentile_ms(seconds, 50),
+        'p99_ms': percentile_ms(seconds, 99),
+        'names_per_sec': batch_size * repeat / sum(seconds),
+        **memory(start)
+    }
+
+def run(grid, gen_batch_sizes=(1, 64, 256), packed=False, steps=30, repeat=50, seed=0):
+    # use saved vocab, so real data matches trained models
+    try:
+        vocab = load_vocab(VOCAB_PATH)
+    except FileNotFoundError:
+        vocab = Vocab.build(load_data(DATA_PATH))
+
+    results = {}
+    for cell in grid['cell']:
+        for hid_size in grid['hid_size']:
+            for batch_size in grid['batch_size']:
+                for data in grid['data']:
+                    name = f'train/{cell}/h{hid_size}/bs{batch_size}/{data}' + ('/packed' if packed else '')
+                    results[name] = bench_train(vocab, cell, batch_size, hid_size, data, packed, steps, seed=seed)
+                    print(f"{name:<40} {results[name]['tokens_per_sec']:>12.0f} tokens/s")
+
+            for batch_size in gen_batch_sizes:
+                name = f'generate/{cell}/h{hid_size}/bs{batch_size}'
+                results[name] = bench_generate(vocab, cell, hid_size, batch_size, repeat=repeat, seed=seed)
+                print(f"{name:<40} p50 {results[name]['p50_ms']:>8.2f} ms | p99 {results[name]['p99_ms']:>8.2f} ms | "
+                      f"{results[name]['names_per_sec']:>10.0f} names/s")
+
+    return {
+        'meta': {
+            'torch': torch.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'device': str(DEVICE),
+            'threads': torch.get_num_threads(),
+            'seed': seed
+        },
+        'results': results
+    }
+
+def compare(current, baseline, tolerance=.1):
+    '''Return metrics worse than baseline by more than tolerance (fraction).
+    Throughput (*_per_sec) must not drop and median latency (*p50_ms) must
+    not grow, p99 is too noisy on shared machines and is only reported.
+    '''
+
+    regressions = []
+    for name, metrics in current['results'].items():
+        if name not in baseline['results']:
+            continue
+
+        for metric, value in metrics.items():
+            base = baseline['results'][name].get(metric)
+            if base is None or value is None or not base:
+                continue
+
+            if metric.endswith('_per_sec'):
+                change = (base - value) / base
+            elif metric.endswith('p50_ms'):
+                change = (value - base) / base
+            else:
+                continue
+
+            if change > tolerance:
+                regressions.append((name, metric, base, value, change))
+
+    return regressions
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark name generator training and generation.')
+    parser.add_argument('--quick', action='store_true', help='Only LSTM, one size, synthetic data.')
+    parser.add_argument('--packed', action='store_true', help='Benchmark packed sequence training.')
+    parser.add_argument('--steps', type=int, default=30, help='Timed training steps per configuration.')
+    parser.add_argument('--repeat', type=int, default=50, help='Timed generation runs per configuration.')
+    parser.add_argument('--threads', type=int, help='Torch threads, fix it to compare runs.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='./models/bench.json')
+    parser.add_argument('--baseline', help='Previous result file to compare against.')
+    parser.add_argument('--tolerance', type=float, default=.1, help='Allowed slowdown before failing (fraction).')
+    args = parser.parse_args()
+
+    # baseline is read before anything is written, and never overwritten by this run
+    baseline = None
+    if args.baseline:
+        if os.path.abspath(args.out) == os.path.abspath(args.baseline):
+            parser.error('--out would overwrite --baseline, write results to another file.')
+        with open(args.baseline) as r:
+            baseline = json.load(r)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    result = run(QUICK_GRID if args.quick else GRID, packed=args.packed, steps=args.steps, repeat=args.repeat, seed=args.seed)
+    with open(args.out, 'w') as w:
+        json.dump(result, w, indent=2)
+    print(f'Results written to {args.out}')
+
+    if baseline is not None:
+        regressions = compare(result, baseline, args.tolerance)
+        for name, metric, base, value, change in regressions:
+            print(f'[REGRESSION] {name} {metric}: {base:.2f} --> {value:.2f} ({change:+.0%})')
+
+        if regressions:
+            sys.exit(1)
+        print(f'No regression against {args.baseline}')
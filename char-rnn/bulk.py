@@ -0,0 +1,174 @@
+'''Generate a large number of unique names that are not in the training data.
+
+Training names are kept in an exact set and generated names in a Bloom filter,
+so memory stays bounded for millions of names. Rejected names (too short,
+copied from training data or already generated) are resampled in the next
+batch, and accepted names are streamed to --out one per line.
+
+    python bulk.py --model LSTM --n 1000000 --out ./models/names_generated.txt
+'''
+import math
+import random
+import hashlib
+import argparse
+from collections import Counter
+import numpy as np
+import torch
+from tqdm import tqdm
+from constant import DATA_PATH, DEVICE, HID_SIZE, EMB_SIZE, MODEL_PATH, VOCAB_PATH
+from vocab import load_vocab
+from sampling import make_generator
+from inference import generate_batch
+from precision import autocast
+from network import RNNNameGenerator, LSTMNameGenerator, GRUNameGenerator
+
+NETWORKS = {'RNN': RNNNameGenerator, 'LSTM': LSTMNameGenerator, 'GRU': GRUNameGenerator}
+
+class BloomFilter:
+    '''Set membership in a fixed size bit array. Never misses a name that was
+    added, but reports a name that wasn't added with probability error_rate.
+    -------------------------
+    Parameters:
+    capacity    : Expected number of items (int).
+    error_rate  : False positive rate at capacity (float).
+    '''
+
+    def __init__(self, capacity, error_rate=1e-3):
+        # optimal bit count and number of hashes for capacity and error rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, item):
+        # double hashing, the i-th position is h1 + i * h2 of one 128 bit digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = np.frombuffer(digest, dtype=np.uint64)
+        return (h1 + np.arange(self.n_hashes, dtype=np.uint64) * (h2 | np.uint64(1))) % np.uint64(self.size)
+
+    def _bits(self, item):
+        # byte index and bit mask of every position
+        positions = self._positions(item)
+        return positions >> np.uint64(3), np.left_shift(np.uint8(1), (positions & np.uint64(7)).astype(np.uint8))
+
+    def __contains__(self, item):
+        index, mask = self._bits(item)
+        return bool(np.all(self.bits[index] & mask))
+
+    def add(self, item):
+        '''Add item, return False if it was (probably) already there.'''
+
+        index, mask = self._bits(item)
+
+        if np.all(self.bits[index] & mask):
+            return False
+
+        # positions may share a byte, so set bits one by one
+        np.bitwise_or.at(self.bits, index, mask)
+        self.count += 1
+        return True
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+def bulk_generate(model, vocab, corpus, n, out, start_phrases=None, batch_size=1024, max_length=10, min_length=3,
+                  temperature=1.0, top_k=None, top_p=None, error_rate=1e-3, generator=None, patience=50):
+    '''Stream n novel, unique names to file out.
+    -------------------------
+    Parameters:
+    model           : Trained name generator (RNN, LSTM or GRU).
+    vocab           : Map char to int (Vocab).
+    corpus          : Training names that must not be emitted (list of str).
+    n               : Number of names to generate (int).
+    out             : Output file path (str).
+    start_phrases   : Start phrases to pick from, default to first chars of
+                      corpus names with their frequency (list of str).
+    batch_size      : Names generated per batch (int).
+    max_length      : Maximum name length (int).
+    min_length      : Minimum name length, shorter names are resampled (int).
+    error_rate      : Bloom filter false positive rate, a false positive only
+                      rejects a novel name, never lets a duplicate through (float).
+    patience        : Stop after this many batches in a row without a new name (int).
+    '''
+
+    # names are compared case insensitive
+    corpus = {name.lower() for name in corpus if name}
+    emitted = BloomFilter(n, error_rate)
+
+    # pick start phrases like the training data starts
+    if start_phrases is None:
+        first = Counter(name[0].upper() for name in corpus if name[0].upper() in vocab)
+        start_phrases, weights = list(first), list(first.values())
+    else:
+        weights = None
+    rng = random.Random(generator.initial_seed() if generator is not None else None)
+
+    written, rejected, idle = 0, Counter(), 0
+    with open(out, 'w', encoding='utf-8') as w, tqdm(total=n, desc='Generating') as progress:
+        while written < n:
+            # rejected rows are resampled in the next batch
+            phrases = rng.choices(start_phrases, weights, k=min(batch_size, 2 * (n - written)))
+            names = generate_batch(model, vocab, phrases, max_length, temperature, top_k, top_p, generator=generator)
+
+            accepted = 0
+            for name in names:
+                if written >= n:
+                    break
+
+                key = name.lower()
+                if len(name) < min_length:
+                    rejected['short'] += 1
+                elif key in corpus:
+                    rejected['corpus'] += 1
+                elif not emitted.add(key):
+                    rejected['duplicate'] += 1
+                else:
+                    w.write(name + '\n')
+                    written += 1
+                    accepted += 1
+
+            progress.update(accepted)
+            progress.set_postfix(rejected=sum(rejected.values()))
+
+            # model can't produce new names anymore, e.g. max_length too short
+            idle = 0 if accepted else idle + 1
+            if idle >= patience:
+                progress.write(f'[WARNING] No new name in {patience} batches, stopped at {written} names')
+                break
+
+    return {'written': written, 'rejected': dict(rejected), 'bloom_bytes': emitted.nbytes, 'bloom_hashes': emitted.n_hashes}
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Generate many unique names not found in training data.')
+    parser.add_argument('--model', choices=list(NETWORKS), default='LSTM')
+    parser.add_argument('--checkpoint', help='Trained state_dict, default to MODEL_PATH of the model.')
+    parser.add_argument('--n', type=int, default=100000, help='Number of names.')
+    parser.add_argument('--out', default='./models/names_generated.txt')
+    parser.add_argument('--start', nargs='+', help='Start phrases, default to first chars of training names.')
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--max-length', type=int, default=10)
+    parser.add_argument('--min-length', type=int, default=3)
+    parser.add_argument('--temperature', type=float, default=1.0)
+    parser.add_argument('--top-k', type=int)
+    parser.add_argument('--top-p', type=float)
+    parser.add_argument('--error-rate', type=float, default=1e-3, help='Bloom filter false positive rate.')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--bf16', action='store_true', help='Run model under bfloat16 autocast.')
+    args = parser.parse_args()
+
+    # load vocab and model
+    vocab = load_vocab(VOCAB_PATH)
+    model = NETWORKS[args.model](len(vocab), HID_SIZE, EMB_SIZE, char2int=vocab, int2char=vocab.int2char)
+    model.load_state_dict(torch.load(args.checkpoint or MODEL_PATH.format(args.model), map_location='cpu'))
+    model.eval()
+
+    corpus = open(DATA_PATH, encoding='utf-8').read().split('\n')
+
+    with autocast(args.bf16):
+        result = bulk_generate(model, vocab, corpus, args.n, args.out, args.start, args.batch_size, args.max_length,
+                               args.min_length, args.temperature, args.top_k, args.top_p, args.error_rate,
+                               make_generator(args.seed, DEVICE))
+    print(f"Wrote {result['written']} names to {args.out} | Rejected: {result['rejected']} | "
+          f"Bloom filter: {result['bloom_bytes'] / 2**20:.1f} MB, {result['bloom_hashes']} hashes")
@@ -0,0 +1,87 @@
+'''Single-file model bundle for fast inference startup.
+
+A bundle holds weights, architecture config and vocab in one file written
+with torch.save. Loading memory-maps the weights (weights_only, no pickle of
+arbitrary objects) and assigns the mapped tensors to the model instead of
+copying them, so weights are only read from disk when first used.
+
+    python bundle.py --model LSTM --out ./models/name_genLSTM.bundle
+'''
+import argparse
+import torch
+
+BUNDLE_VERSION = 1
+
+def model_config(model):
+    # architecture read back from layer shapes
+    from network import RNNNameGenerator, LSTMNameGenerator, GRUNameGenerator
+    networks = {'RNN': RNNNameGenerator, 'LSTM': LSTMNameGenerator, 'GRU': GRUNameGenerator}
+
+    return {
+        'cell': next(k for k, v in networks.items() if type(model) is v),
+        'vocab_size': model.embedding.num_embeddings,
+        'embedding_size': model.embedding.embedding_dim,
+        'hidden_size': model.output.in_features
+    }
+
+def save_bundle(model, vocab, path):
+    '''Write model weights, config and vocab to a single file.
+    -------------------------
+    Parameters:
+    model   : Trained name generator, float weights (RNN, LSTM or GRU).
+    vocab   : Map char to int (Vocab).
+    path    : Output file path (str).
+    '''
+
+    torch.save({
+        'format_version': BUNDLE_VERSION,
+        'config': model_config(model),
+        'vocab': list(vocab.chars),
+        'state_dict': {k: v.detach().cpu().contiguous() for k, v in model.state_dict().items()}
+    }, path)
+
+def load_bundle(path, device='cpu'):
+    '''Open bundle with memory-mapped weights, return (model, vocab).'''
+
+    bundle = torch.load(path, mmap=True, weights_only=True, map_location='cpu')
+    if bundle.get('format_version') != BUNDLE_VERSION:
+        raise ValueError(f'Unsupported bundle version: {bundle.get("format_version")}')
+
+    # imported here, so opening a bundle doesn't pay for anything else
+    from vocab import Vocab
+    from network import RNNNameGenerator, LSTMNameGenerator, GRUNameGenerator
+    networks = {'RNN': RNNNameGenerator, 'LSTM': LSTMNameGenerator, 'GRU': GRUNameGenerator}
+
+    config = bundle['config']
+    vocab = Vocab(bundle['vocab'])
+
+    # take the mapped tensors as they are instead of copying into new weights
+    # (meta device init would skip allocation too, but it's much slower for RNN layers)
+    model = networks[config['cell']](config['vocab_size'], config['hidden_size'], config['embedding_size'],
+                                     char2int=vocab, int2char=vocab.int2char)
+    model.load_state_dict(bundle['state_dict'], assign=True)
+
+    return model.to(device).eval(), vocab
+
+if __name__ == '__main__':
+    from constant import HID_SIZE, EMB_SIZE, MODEL_PATH, VOCAB_PATH
+    from vocab import load_vocab
+    from network import RNNNameGenerator, LSTMNameGenerator, GRUNameGenerator
+
+    NETWORKS = {'RNN': RNNNameGenerator, 'LSTM': LSTMNameGenerator, 'GRU': GRUNameGenerator}
+
+    parser = argparse.ArgumentParser(description='Pack trained name generator into a single-file bundle.')
+    parser.add_argument('--model', choices=list(NETWORKS), default='LSTM')
+    parser.add_argument('--checkpoint', help='Trained state_dict, default to MODEL_PATH of the model.')
+    parser.add_argument('--out', help='Output path, default to ./models/name_gen<MODEL>.bundle.')
+    parser.add_argument('--hidden-size', type=int, default=HID_SIZE)
+    parser.add_argument('--embedding-size', type=int, default=EMB_SIZE)
+    args = parser.parse_args()
+
+    vocab = load_vocab(VOCAB_PATH)
+    model = NETWORKS[args.model](len(vocab), args.hidden_size, args.embedding_size, char2int=vocab, int2char=vocab.int2char)
+    model.load_state_dict(torch.load(args.checkpoint or MODEL_PATH.format(args.model), map_location='cpu'))
+
+    out = args.out or f'./models/name_gen{args.model}.bundle'
+    save_bundle(model, vocab, out)
+    print(f'Bundle written to {out}')
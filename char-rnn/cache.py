@@ -0,0 +1,112 @@
+import torch
+import weakref
+import itertools
+import threading
+from collections import OrderedDict
+from constant import DEVICE
+
+class PrefixCache:
+    '''Cache hidden state of the model after it has read a start phrase.
+    Entries are keyed by (model token, phrase), so one cache can be shared by
+    several models. Every model object gets its own token, a new model never
+    sees states of a collected one. Call clear() after the model weights change.
+    -------------------------
+    Parameters:
+    max_size    : Maximum number of cached phrases (int).
+    eviction    : Which entry goes first when the cache is full, either
+                  'lru' (least recently used) or 'fifo' (oldest). (str)
+    '''
+
+    def __init__(self, max_size=1024, eviction='lru'):
+        if eviction not in ('lru', 'fifo'):
+            raise ValueError(f'Unknown eviction policy: {eviction}')
+
+        self.max_size = max_size
+        self.eviction = eviction
+        self.hits = 0
+        self.misses = 0
+
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+        # model -> token, id() of a collected model can be reused by a new one
+        self._tokens = weakref.WeakKeyDictionary()
+        self._next_token = itertools.count()
+
+    def __len__(self):
+        return len(self._states)
+
+    def _token(self, model):
+        # called with lock held
+        token = self._tokens.get(model)
+        if token is None:
+            token = self._tokens[model] = next(self._next_token)
+        return token
+
+    def get(self, model, phrase):
+        with self._lock:
+            return self._get((self._token(model), phrase))
+
+    def put(self, model, phrase, h):
+        with self._lock:
+            self._states[(self._token(model), phrase)] = h
+
+            # evict until cache fits max_size
+            while len(self._states) > self.max_size:
+                self._states.popitem(last=False)
+
+    def clear(self, model=None):
+        with self._lock:
+            if model is None:
+                self._states.clear()
+            else:
+                token = self._token(model)
+                for key in [k for k in self._states if k[0] == token]:
+                    del self._states[key]
+
+    def longest(self, model, phrase):
+        '''Find the longest cached prefix of phrase.
+        Returns its length and hidden state, (0, None) if nothing is cached.
+        '''
+
+        with self._lock:
+            return self._longest(model, phrase)
+
+    @torch.no_grad()
+    def warmup(self, model, vocab, phrase):
+        '''Return hidden state after the model has read phrase, reusing the
+        longest cached prefix and caching the result. None for empty phrase.
+        '''
+
+        if not phrase:
+            return None
+
+        # cache is shared by serving threads, count under the lock
+        with self._lock:
+            i, h = self._longest(model, phrase)
+            if i == len(phrase):
+                self.hits += 1
+                return h
+            self.misses += 1
+
+        # run only the remaining chars from the cached state
+        x_torch = torch.tensor([[vocab[ch] for ch in phrase[i:]]], dtype=torch.int64, device=DEVICE)
+        _, h = model(x_torch, h)
+        self.put(model, phrase, h)
+
+        return h
+
+    def _get(self, key):
+        h = self._states.get(key)
+        if h is not None and self.eviction == 'lru':
+            self._states.move_to_end(key)
+        return h
+
+    def _longest(self, model, phrase):
+        token = self._token(model)
+        for i in range(len(phrase), 0, -1):
+            h = self._get((token, phrase[:i]))
+            if h is not None:
+                return i, h
+
+        return 0, None
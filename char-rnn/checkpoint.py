@@ -0,0 +1,122 @@
+import os
+import glob
+import random
+import shutil
+import numpy as np
+import torch
+from concurrent.futures import ThreadPoolExecutor
+
+def snapshot(obj):
+    '''Copy every tensor in nested dicts, lists and tuples to CPU, so
+    training can keep updating the originals while the copy is written.'''
+
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return obj
+
+def rng_state():
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state()
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def atomic_save(obj, path):
+    # write to temporary file first, so a crash never leaves a partial checkpoint at path
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as w:
+        torch.save(obj, w)
+        w.flush()
+        os.fsync(w.fileno())
+    os.replace(tmp, path)
+
+def list_checkpoints(directory):
+    # epoch checkpoints, oldest first
+    return sorted(glob.glob(os.path.join(directory, 'epoch-*.pt')))
+
+def latest_checkpoint(directory):
+    checkpoints = list_checkpoints(directory)
+    return checkpoints[-1] if checkpoints else None
+
+def load_checkpoint(path):
+    # full training state holds RNG states and history, not only tensors
+    return torch.load(path, map_location='cpu', weights_only=False)
+
+def training_seed(directory):
+    # seed of the training run that wrote the checkpoints, None if unknown
+    path = latest_checkpoint(directory)
+    return load_checkpoint(path)['meta'].get('seed') if path is not None else None
+
+class CheckpointManager:
+    '''Write full training state every epoch on a background thread.
+    Keeps the last keep_last epoch checkpoints and best.pt in directory, and
+    also writes model weights alone to weights_path when the model improves,
+    like train() did before.
+    -------------------------
+    Parameters:
+    directory       : Checkpoint directory (str).
+    keep_last       : Number of latest epoch checkpoints to keep (int).
+    weights_path    : Path of best model state_dict, skipped if None (str).
+    meta            : Extra info stored in every checkpoint, e.g. model
+                      type and data seed needed to rebuild the run (dict).
+    '''
+
+    def __init__(self, directory, keep_last=3, weights_path=None, meta=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.keep_last = keep_last
+        self.weights_path = weights_path
+        self.meta = meta or {}
+
+        # single writer keeps checkpoints in order
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    def save(self, state, epoch, is_best=False):
+        '''Snapshot state and write it in background.
+        Waits for the previous write first, so at most one copy is in memory.
+        '''
+
+        self.wait()
+        state = snapshot({**state, 'meta': self.meta})
+        self.pending = self.executor.submit(self._write, state, epoch, is_best)
+
+    def _write(self, state, epoch, is_best):
+        path = os.path.join(self.directory, f'epoch-{epoch:05d}.pt')
+        atomic_save(state, path)
+
+        if is_best:
+            best = os.path.join(self.directory, 'best.pt')
+            shutil.copyfile(path, best + '.tmp')
+            os.replace(best + '.tmp', best)
+
+            if self.weights_path is not None:
+                atomic_save(state['model'], self.weights_path)
+
+        # remove old epoch checkpoints
+        for old in list_checkpoints(self.directory)[:-self.keep_last]:
+            os.remove(old)
+
+    def wait(self):
+        # raises error of the background write, if any
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
@@ -12,5 +12,14 @@ TEST_SIZE = .2
 VAL_SIZE = .5
 GRAD_CLIP = 5
 MODEL_PATH = './models/name_gen{}.pt'
+VOCAB_PATH = './models/vocab.json'
+QUANT_MODEL_PATH = './models/name_gen{}.int8.pt'
+CHECKPOINT_DIR = './models/checkpoints/{}'
+KEEP_LAST = 3     # Latest epoch checkpoints to keep
 HID_SIZE = 128
 EMB_SIZE = 64
+PACKED = False    # Packed sequence training, skips <PAD> steps
+BF16 = False      # bfloat16 autocast for forward pass and loss, weights stay fp32
+STREAMING = False # Stream names from disk, for corpora that don't fit in memory
+METRICS_PATH = './models/metrics.jsonl'    # Training throughput log, None to disable
+PROFILE_STEPS = None    # Steps (start, end) traced by torch.profiler, e.g. (10, 20)
@@ -1,9 +1,14 @@
+import os
+import zlib
+import hashlib
 import numpy as np
 import random
 import torch
-from torch.utils.data import TensorDataset, DataLoader
-import pickle
-from constant import BATCH_SIZE, DATA_PATH
+from functools import partial
+from torch.utils.data import TensorDataset, DataLoader, Sampler, DistributedSampler, IterableDataset, get_worker_info
+import torch.distributed as dist
+from vocab import Vocab, load_vocab
+from constant import BATCH_SIZE, DATA_PATH, VOCAB_PATH, TEST_SIZE
 
 def load_data(path):
     
@@ -22,22 +27,14 @@ def load_data(path):
     return names
 
 def build_vocab(names):
-    # get all possible chars
-    chars = tuple(set(''.join(names)))
-
-    # map int to char
+    # get all possible chars, sorted so indices are the same on every run
     # start vocab index from 1, cz we'll put <PAD> token in index 0
-    int2char = dict(enumerate(chars, 1))
-    int2char[0] = '<PAD>'
-
-    # map back char to int
-    char2int = {v: k for k, v in int2char.items()}
+    vocab = Vocab.build(names)
 
     # save vocab to disk
-    pickle.dump(char2int, open('./models/vocab.pkl', 'wb'))
-    pickle.dump(int2char, open('./models/vocab_int2char.pkl', 'wb'))
+    vocab.save(VOCAB_PATH)
 
-    return char2int, int2char
+    return vocab, vocab.int2char
 
 def encode_words(names, vocab):    
     # encode words
@@ -62,6 +59,82 @@ def pad_features(names, seq_length=None):
 
     return features
 
+def save_array(path, array):
+    # write next to the target, then swap, so readers never see a partial file.
+    # pid in the temporary name keeps concurrent writers (spawned workers) apart
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as w:
+        np.save(w, array)
+    os.replace(tmp, path)
+
+def compile_data(path, vocab, cache_dir='./models/cache'):
+    '''Encode names file once and cache it on disk as memory-mappable arrays.
+    The cache is keyed by a hash of the source file and the vocab, so it is
+    rebuilt whenever one of them changes.
+    -------------------------
+    Parameters:
+    path        : Names file, one name per line (str).
+    vocab       : Vocabulary (Vocab).
+    cache_dir   : Directory for compiled files (str).
+
+    Returns flat codes of all names and their offsets,
+    name i is codes[offsets[i]:offsets[i+1]].
+    '''
+
+    with open(path, 'rb') as r:
+        raw = r.read()
+
+    # key cache by source content and vocab
+    key = hashlib.sha1(raw)
+    key.update(vocab.fingerprint.encode('utf-8'))
+    prefix = os.path.join(cache_dir, f'names-{key.hexdigest()[:16]}')
+
+    # use compiled arrays if exists
+    if os.path.exists(prefix + '.offsets.npy'):
+        codes = np.load(prefix + '.codes.npy', mmap_mode='r')
+        offsets = np.load(prefix + '.offsets.npy', mmap_mode='r')
+        return codes, offsets
+
+    # every char as its code point, utf-32 has fixed 4 bytes per char
+    code_points = np.frombuffer(raw.decode('utf-8').encode('utf-32-le'), dtype=np.uint32)
+
+    # one name per line, same as str.split('\n')
+    newline = np.flatnonzero(code_points == ord('\n'))
+    lengths = np.diff(np.concatenate(([-1], newline, [len(code_points)]))) - 1
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+    # encode all names at once
+    codes = vocab.encode_code_points(np.delete(code_points, newline))
+
+    # write codes before offsets, so offsets file marks a complete cache
+    os.makedirs(cache_dir, exist_ok=True)
+    save_array(prefix + '.codes.npy', codes)
+    save_array(prefix + '.offsets.npy', offsets)
+
+    return codes, offsets
+
+def pad_codes(codes, offsets, seq_length=None):
+    '''Build right padded feature matrix from flat codes and offsets without
+    looping over names, same result as pad_features(encode_words(...)).
+    '''
+
+    lengths = np.diff(offsets)
+
+    # if seq_length is None, then select the longest feature as maximum
+    if seq_length == None:
+        seq_length = int(lengths.max(initial=0))
+
+    # row and column of every char
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    cols = np.arange(len(codes)) - np.repeat(offsets[:-1], lengths)
+
+    # fill feature template from front, drop chars after seq_length
+    features = np.zeros((len(lengths), seq_length), dtype=int)
+    keep = cols < seq_length
+    features[rows[keep], cols[keep]] = codes[keep]
+
+    return features
+
 def split_data(x, train_size=.8, test_size=.2, val_set=True, val_size=.5):
     '''Split datasets into train, test, and validation set (optional).
     -------------------------
@@ -90,7 +163,60 @@ def split_data(x, train_size=.8, test_size=.2, val_set=True, val_size=.5):
 
         return (train_x, test_x, val_x)
 
-def make_batch(train_feature, test_feature, valid_feature=None, batch_size=64):
+class BucketBatchSampler(Sampler):
+    '''Yield batches of indices whose names have similar length, so packed
+    batches carry little padding. Batch order is shuffled every epoch, call
+    set_epoch to get a new order. In distributed training every process
+    takes its own share of the batches.
+    -------------------------
+    Parameters:
+    lengths         : Name length of each sample (1D array).
+    batch_size      : Batch size (int).
+    shuffle         : Shuffle names of equal length and batch order (bool).
+    num_replicas    : Number of distributed processes (int).
+    rank            : Rank of this process (int).
+    seed            : Shuffle seed, must be the same on every process (int).
+    '''
+
+    def __init__(self, lengths, batch_size=64, shuffle=True, num_replicas=1, rank=0, seed=None):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        # every process runs the same number of batches
+        n_batches = (len(self.lengths) + self.batch_size - 1) // self.batch_size
+        return n_batches // self.num_replicas
+
+    def __iter__(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+
+        # sort by length, random tie break so buckets differ between epochs
+        if self.shuffle:
+            index = np.lexsort((rng.random(len(self.lengths)), self.lengths))
+        else:
+            index = np.argsort(self.lengths, kind='stable')
+
+        batches = [index[i:i+self.batch_size] for i in range(0, len(index), self.batch_size)]
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+
+        # take share of this process
+        for batch in batches[self.rank:len(self) * self.num_replicas:self.num_replicas]:
+            yield batch.tolist()
+
+def feature_lengths(features):
+    # count chars of each right padded name
+    return (features != 0).sum(axis=1)
+
+def make_batch(train_feature, test_feature, valid_feature=None, batch_size=64, bucket=False, distributed=False):
     '''Generate data batch using PyTorch Dataset and DataLoader.
     -------------------------
     Parameters:
@@ -98,57 +224,226 @@ def make_batch(train_feature, test_feature, valid_feature=None, batch_size=64):
     test_feature    : Test feature (tuple).
     valid_feature   : Validation feature (tuple).
     batch_size      : Batch size. Default to 64 (int).
+    bucket          : Batch names of similar length together and add their
+                      lengths to each batch, used for packed training (bool).
+    distributed     : Shard batches across processes of the initialized
+                      process group (bool).
     '''
 
-    # generate TensorDataset
-    trainset = TensorDataset(torch.from_numpy(train_feature))
-    testset = TensorDataset(torch.from_numpy(test_feature))
+    # process share in distributed training
+    num_replicas = dist.get_world_size() if distributed else 1
+    rank = dist.get_rank() if distributed else 0
 
-    # if validation feature provided
-    if valid_feature != None:
-        validset = TensorDataset(torch.from_numpy(valid_feature))
+    def make_loader(feature):
+        if not bucket:
+            dataset = TensorDataset(torch.from_numpy(feature))
+            if not distributed:
+                return DataLoader(dataset, shuffle=True, batch_size=batch_size)
 
-    # generate DataLoader
-    trainloader = DataLoader(trainset, shuffle=True, batch_size=batch_size)
-    testloader = DataLoader(testset, shuffle=True, batch_size=batch_size)
+            sampler = DistributedSampler(dataset, num_replicas=num_replicas, rank=rank, shuffle=True)
+            return DataLoader(dataset, sampler=sampler, batch_size=batch_size)
 
-    try:
-        valloader = DataLoader(validset, shuffle=True, batch_size=batch_size)
+        lengths = feature_lengths(feature)
+        dataset = TensorDataset(torch.from_numpy(feature), torch.from_numpy(lengths))
+        sampler = BucketBatchSampler(lengths, batch_size, num_replicas=num_replicas, rank=rank,
+                                     seed=0 if distributed else None)
+        return DataLoader(dataset, batch_sampler=sampler)
 
-        return trainloader, testloader, valloader
+    # generate DataLoader
+    trainloader = make_loader(train_feature)
+    testloader = make_loader(test_feature)
 
-    except:
-        # validation feature were not provided.
+    # validation feature were not provided.
+    if valid_feature is None:
         return trainloader, testloader
 
-def load(path):
-    # load dataset
-    names = load_data(path)
+    valloader = make_loader(valid_feature)
+
+    return trainloader, testloader, valloader
 
+def load(path, packed=False, distributed=False, batch_size=BATCH_SIZE):
     try:
         # load vocab
-        vocab = pickle.load(open('./models/vocab.pkl', 'rb'))
-        int2char = pickle.load(open('./models/vocab_int2char.pkl', 'rb'))
+        vocab = load_vocab(VOCAB_PATH)
+        int2char = vocab.int2char
         print('Use existing vocabulary.')
-    except:
+    except FileNotFoundError:
         # build vocab
-        vocab, int2char = build_vocab(names)
+        vocab, int2char = build_vocab(load_data(path))
 
-    # encode words
-    enc_words = encode_words(names, vocab)
+    # encode words, compiled once and reused while names and vocab don't change
+    codes, offsets = compile_data(path, vocab)
     # pad features
-    padded = pad_features(enc_words)
+    padded = pad_codes(codes, offsets)
+    # shuffle dataset
+    padded = padded[np.random.permutation(len(padded))]
     # split data
     train, test = split_data(padded, val_set=False)
     # make batch
-    trainloader, testloader = make_batch(train, test, batch_size=BATCH_SIZE)
+    trainloader, testloader = make_batch(train, test, batch_size=batch_size, bucket=packed, distributed=distributed)
 
     return (trainloader, testloader), vocab, int2char
 
+def read_chunks(path, start=0, end=None, chunk_size=1 << 20):
+    '''Yield lists of lines (bytes) whose first byte lies in [start, end)
+    of the file, reading chunk_size bytes at a time.'''
+
+    with open(path, 'rb') as r:
+        end = os.fstat(r.fileno()).st_size if end is None else end
+
+        # line crossing start belongs to the previous range
+        pos = start
+        if start > 0:
+            r.seek(start - 1)
+            pos += len(r.readline()) - 1
+
+        carry = b''
+        while pos < end:
+            chunk = r.read(chunk_size)
+            if not chunk:
+                # last line without trailing newline
+                if carry:
+                    yield [carry]
+                return
+
+            lines = (carry + chunk).split(b'\n')
+            carry = lines.pop()
+
+            # keep lines starting before end
+            batch = []
+            for line in lines:
+                if pos >= end:
+                    break
+                batch.append(line)
+                pos += len(line) + 1
+
+            yield batch
+
+def stream_vocab(path, chunk_size=1 << 20):
+    # build vocab in one pass over the file, without keeping names in memory
+    chars = set()
+    for lines in read_chunks(path, chunk_size=chunk_size):
+        chars.update(b'\n'.join(lines).decode('utf-8'))
+    chars.discard('\r')
+
+    return Vocab(sorted(chars))
+
+class NameStream(IterableDataset):
+    '''Stream encoded names from a text file with constant memory.
+    The file is split into byte ranges, one per DataLoader worker of every
+    process, each range is read in chunks, encoded on the fly and shuffled
+    through a bounded buffer. Names go to the test split by hash, so
+    the split is the same every epoch without an index of the file.
+    -------------------------
+    Parameters:
+    path            : Names file, one name per line (str).
+    vocab           : Vocab covering every char of the file (Vocab).
+    split           : Either 'train' or 'test' (str).
+    test_size       : Fraction of names in the test split (float).
+    shuffle_buffer  : Names held for shuffling, 0 keeps file order (int).
+    chunk_size      : Bytes read at a time (int).
+    num_replicas    : Number of processes in distributed training (int).
+    rank            : Rank of this process (int).
+    seed            : Shuffle seed, same on every process (int).
+    '''
+
+    def __init__(self, path, vocab, split='train', test_size=TEST_SIZE, shuffle_buffer=10000, chunk_size=1 << 20,
+                 num_replicas=1, rank=0, seed=0):
+        self.path = path
+        self.vocab = vocab
+        self.split = split
+        self.test_size = test_size
+        self.shuffle_buffer = shuffle_buffer
+        self.chunk_size = chunk_size
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _names(self, start, end):
+        # encoded names of this split in byte range [start, end)
+        threshold = int(self.test_size * 100)
+        for lines in read_chunks(self.path, start, end, self.chunk_size):
+            lines = [line.rstrip(b'\r') for line in lines]
+            lines = [line for line in lines if line and ((zlib.crc32(line) % 100 < threshold) == (self.split == 'test'))]
+            if not lines:
+                continue
+
+            # encode whole chunk at once
+            codes, offsets = self.vocab.encode([line.decode('utf-8') for line in lines])
+            for i in range(len(lines)):
+                yield codes[offsets[i]:offsets[i + 1]]
+
+    def __iter__(self):
+        # every worker of every process reads its own byte range
+        info = get_worker_info()
+        num_workers, worker_id = (info.num_workers, info.id) if info is not None else (1, 0)
+        shard = self.rank * num_workers + worker_id
+        n_shards = self.num_replicas * num_workers
+
+        size = os.path.getsize(self.path)
+        names = self._names(size * shard // n_shards, size * (shard + 1) // n_shards)
+
+        if not self.shuffle_buffer:
+            yield from names
+            return
+
+        # swap every new name with a random one of the buffer
+        rng = np.random.default_rng([self.seed, self.epoch, shard])
+        buffer = []
+        for name in names:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(name)
+                continue
+
+            i = rng.integers(len(buffer))
+            yield buffer[i]
+            buffer[i] = name
+
+        rng.shuffle(buffer)
+        yield from buffer
+
+def pad_collate(names, packed=False):
+    # right pad names of one batch to its longest name
+    lengths = np.array([len(name) for name in names])
+    feature = torch.from_numpy(pad_codes(np.concatenate(names), np.concatenate(([0], np.cumsum(lengths)))))
+
+    if packed:
+        return feature, torch.from_numpy(lengths)
+    return (feature,)
+
+def load_stream(path, packed=False, distributed=False, batch_size=BATCH_SIZE, num_workers=0, shuffle_buffer=10000):
+    '''Same as load() but names are streamed from disk, for corpora that don't
+    fit in memory. The loaders have no len(), and batches are padded per batch.
+    '''
+
+    try:
+        vocab = load_vocab(VOCAB_PATH)
+        print('Use existing vocabulary.')
+    except FileNotFoundError:
+        vocab = stream_vocab(path)
+        vocab.save(VOCAB_PATH)
+
+    # process share in distributed training
+    num_replicas = dist.get_world_size() if distributed else 1
+    rank = dist.get_rank() if distributed else 0
+
+    collate = partial(pad_collate, packed=packed)
+    trainset = NameStream(path, vocab, 'train', shuffle_buffer=shuffle_buffer, num_replicas=num_replicas, rank=rank)
+    testset = NameStream(path, vocab, 'test', shuffle_buffer=0, num_replicas=num_replicas, rank=rank)
+
+    trainloader = DataLoader(trainset, batch_size=batch_size, collate_fn=collate, num_workers=num_workers)
+    testloader = DataLoader(testset, batch_size=batch_size, collate_fn=collate, num_workers=num_workers)
+
+    return (trainloader, testloader), vocab, vocab.int2char
+
 if __name__ == '__main__':
 
     # load dataset
-    loader, vocab = load(DATA_PATH)
+    loader, vocab, int2char = load(DATA_PATH)
     trainloader, testloader = loader
     print(len(vocab))
     print(len(trainloader))
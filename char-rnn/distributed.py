@@ -0,0 +1,92 @@
+'''Data-parallel training of the name generator over several processes.
+
+Every process trains a replica on its own shard of the batches and gradients
+are averaged with all-reduce over the gloo backend, so it runs on CPU-only
+nodes. Run on a single node with
+
+    python distributed.py --model LSTM --nproc 4
+
+and on several nodes by starting it on each of them with the same --nnodes,
+--master-addr and --master-port, and their own --node-rank.
+'''
+import os
+import json
+import argparse
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from constant import DATA_PATH, DEVICE, HID_SIZE, EMB_SIZE, EPOCH, LR, PRINT_EVERY, GRAD_CLIP, MODEL_PATH, PACKED, STREAMING
+from network import RNNNameGenerator, LSTMNameGenerator, GRUNameGenerator
+from dataloader import load, load_stream
+from train import train, plot_loss
+
+NETWORKS = {'RNN': RNNNameGenerator, 'LSTM': LSTMNameGenerator, 'GRU': GRUNameGenerator}
+
+def worker(local_rank, args):
+    rank = args.node_rank * args.nproc + local_rank
+    world_size = args.nnodes * args.nproc
+
+    # MASTER_ADDR and MASTER_PORT are read from environment
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+
+    # split CPU cores between local processes
+    torch.set_num_threads(args.threads)
+
+    try:
+        # first process of each node builds vocab and compiled data,
+        # the others wait and reuse them
+        if local_rank != 0:
+            dist.barrier()
+
+        # same seed, so every process gets the same shuffle and split
+        np.random.seed(args.seed)
+        loader, vocab, int2char = (load_stream if STREAMING else load)(DATA_PATH, packed=PACKED, distributed=True)
+
+        if local_rank == 0:
+            dist.barrier()
+
+        # same initial weights, DDP also broadcasts them from rank 0
+        torch.manual_seed(args.seed)
+        network = NETWORKS[args.model](len(vocab), HID_SIZE, EMB_SIZE, char2int=vocab, int2char=int2char)
+        network = DistributedDataParallel(network.to(DEVICE))
+        save_path = MODEL_PATH.format(args.model)
+
+        # unpack loader
+        trainloader, testloader = loader
+
+        # train, only rank 0 saves checkpoint
+        model, history = train(network, trainloader, testloader, args.epochs, LR, PRINT_EVERY, GRAD_CLIP, save_path)
+
+        # only rank 0 writes history
+        if rank == 0:
+            with open(f'./models/history{args.model}.json', 'w') as f:
+                json.dump(history, f)
+            plot_loss(history)
+
+    finally:
+        dist.destroy_process_group()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Train name generator with distributed data parallel.')
+    parser.add_argument('--model', choices=list(NETWORKS), default='LSTM')
+    parser.add_argument('--nproc', type=int, default=2, help='Processes per node.')
+    parser.add_argument('--nnodes', type=int, default=1)
+    parser.add_argument('--node-rank', type=int, default=0)
+    parser.add_argument('--master-addr', default='127.0.0.1')
+    parser.add_argument('--master-port', default='29500')
+    parser.add_argument('--threads', type=int, help='Torch threads per process, default to cores / nproc.')
+    parser.add_argument('--epochs', type=int, default=EPOCH)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.threads is None:
+        args.threads = max(1, (os.cpu_count() or 1) // args.nproc)
+
+    os.environ['MASTER_ADDR'] = args.master_addr
+    os.environ['MASTER_PORT'] = str(args.master_port)
+
+    print(f'Training start on {args.nproc} processes x {args.nnodes} nodes...')
+    mp.spawn(worker, args=(args,), nprocs=args.nproc)
@@ -0,0 +1,125 @@
+import json
+import argparse
+import torch
+from torch import nn
+from constant import HID_SIZE, EMB_SIZE, MODEL_PATH, VOCAB_PATH
+from vocab import load_vocab
+from network import RNNNameGenerator, LSTMNameGenerator, GRUNameGenerator
+
+NETWORKS = {'RNN': RNNNameGenerator, 'LSTM': LSTMNameGenerator, 'GRU': GRUNameGenerator}
+
+class GeneratorStep(nn.Module):
+    '''Single generation step with the same signature for every cell type.
+    Takes x (batch_size, 1), h and c (num_layers, batch_size, hidden_size) and
+    returns last logits (batch_size, vocab_size), h and c. RNN and GRU don't
+    have cell state, so c is returned untouched.
+    '''
+
+    def __init__(self, model):
+        super(GeneratorStep, self).__init__()
+
+        self.model = model
+        self.is_lstm = isinstance(model_rnn(model), nn.LSTM)
+
+    def forward(self, x, h, c):
+        if self.is_lstm:
+            out, (h, c) = self.model(x, (h, c))
+        else:
+            out, h = self.model(x, h)
+
+        return out[:, -1], h, c
+
+def model_rnn(model):
+    # recurrent layer of the name generator
+    return next(m for m in model.modules() if isinstance(m, nn.RNNBase))
+
+def model_config(model, cell):
+    rnn = model_rnn(model)
+    return {
+        'format_version': 1,
+        'cell': cell,
+        'num_layers': rnn.num_layers,
+        'hidden_size': rnn.hidden_size,
+        # int2char as list, index 0 is <PAD>
+        'vocab': [model.int2char[i] for i in range(model.vocab_size)]
+    }
+
+def export(model, cell, path, fmt='torchscript'):
+    '''Write self-contained generation step of the model with vocab embedded.
+    -------------------------
+    Parameters:
+    model   : Trained name generator (RNN, LSTM or GRU).
+    cell    : Cell type of the model, either 'RNN', 'LSTM' or 'GRU' (str).
+    path    : Output file path (str).
+    fmt     : Export format, either 'torchscript' or 'onnx' (str).
+    '''
+
+    model = model.cpu().eval()
+    step = GeneratorStep(model).eval()
+    config = model_config(model, cell)
+
+    # example inputs, batch dimension stays dynamic
+    rnn = model_rnn(model)
+    x = torch.ones((2, 1), dtype=torch.int64)
+    h = torch.zeros(rnn.num_layers, 2, rnn.hidden_size)
+    c = torch.zeros(rnn.num_layers, 2, rnn.hidden_size)
+
+    if fmt == 'torchscript':
+        with torch.no_grad():
+            traced = torch.jit.trace(step, (x, h, c))
+        torch.jit.save(traced, path, _extra_files={'config.json': json.dumps(config)})
+
+    elif fmt == 'onnx':
+        # onnx is only needed to export, import it lazily
+        import onnx
+
+        torch.onnx.export(step, (x, h, c), path,
+                          input_names=['x', 'h', 'c'],
+                          output_names=['logits', 'h_out', 'c_out'],
+                          dynamic_axes={
+                              'x': {0: 'batch'},
+                              'h': {1: 'batch'},
+                              'c': {1: 'batch'},
+                              'logits': {0: 'batch'},
+                              'h_out': {1: 'batch'},
+                              'c_out': {1: 'batch'}
+                          },
+                          dynamo=False)
+
+        # embed config and vocab into model metadata
+        onnx_model = onnx.load(path)
+        meta = onnx_model.metadata_props.add()
+        meta.key, meta.value = 'config', json.dumps(config)
+        onnx.save(onnx_model, path)
+
+    else:
+        raise ValueError(f'Unknown export format: {fmt}')
+
+    return config
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Export trained name generator for inference runtime.')
+    parser.add_argument('--model', choices=list(NETWORKS), default='LSTM')
+    parser.add_argument('--checkpoint', help='Trained state_dict, default to MODEL_PATH of the model.')
+    parser.add_argument('--format', choices=['torchscript', 'onnx'], default='torchscript')
+    parser.add_argument('--out', help='Output path, default to ./models/name_gen<MODEL>.<pt|onnx>.')
+    parser.add_argument('--hidden-size', type=int, default=HID_SIZE)
+    parser.add_argument('--embedding-size', type=int, default=EMB_SIZE)
+    args = parser.parse_args()
+
+    checkpoint = args.checkpoint or MODEL_PATH.format(args.model)
+    out = args.out or './models/name_gen{}.{}'.format(args.model, 'onnx' if args.format == 'onnx' else 'ts.pt')
+
+    # load vocabs
+    print('Load vocabs...')
+    vocab = load_vocab(VOCAB_PATH)
+    int2char = vocab.int2char
+
+    # define network and apply checkpoint
+    print('Apply checkpoints to model...')
+    model = NETWORKS[args.model](len(vocab), args.hidden_size, args.embedding_size, char2int=vocab, int2char=int2char)
+    model.load_state_dict(torch.load(checkpoint, map_location='cpu'))
+
+    print(f'Export {args.format} model to {out}')
+    export(model, args.model, out, args.format)
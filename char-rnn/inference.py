@@ -1,84 +1,238 @@
 import torch
-from torch.nn import functional as F
+from torch import nn
 from dataloader import encode_words, pad_features
-import pickle
-import numpy as np
-from constant import DEVICE, HID_SIZE, EMB_SIZE, MODEL_PATH
+import argparse
+from sampling import sample
+from precision import autocast
+from constant import DEVICE, HID_SIZE, EMB_SIZE, MODEL_PATH, QUANT_MODEL_PATH, VOCAB_PATH
+from vocab import load_vocab
 from network import RNNNameGenerator, LSTMNameGenerator, GRUNameGenerator
 
 def load_model(path):
     checkpoint = torch.load(path)
     return checkpoint
 
-def generate(model, vocab, start_phrase='A', max_length=6, temperature=1.0, top_k=None):
-
-    with torch.no_grad():
-        #  encode start phrase
-        x_enc = [[vocab[ch] for ch in start_phrase]]
-        
-        # here we dont need to pad the vector
-        # convert encoded phrase to tensor
-        x_torch = torch.tensor(x_enc, dtype=torch.int64)
-
-        # create list for output
-        char_out = start_phrase.split()
-
-        # move to device
-        x_torch = x_torch.to(DEVICE)
-        model = model.to(DEVICE)
-
+@torch.no_grad()
+def _iter_tokens(model, vocab, start_phrase, max_length, temperature, top_k, top_p, greedy, generator, cache, cancel):
+    # yield sampled token (still on device) one step at a time,
+    # only the hidden state and the last token are kept between steps
+    model = model.to(DEVICE)
+
+    #  encode start phrase
+    # here we dont need to pad the vector
+    x_torch = torch.tensor([[vocab[ch] for ch in start_phrase]], dtype=torch.int64, device=DEVICE)
+
+    # running through start phrase to generate hidden_state
+    # here we leave the last character cz we will feed it in
+    # the generating phase as the first sequence
+    if cache is not None:
+        h = cache.warmup(model, vocab, start_phrase[:-1])
+    elif len(start_phrase) > 1:
+        _, h = model(x_torch[:, :-1])
+    else:
         # init empty hidden state
         h = None
-
-        # running through start phrase to generate hidden_state
-        # here we leave the last character cz we will feed it in
-        # the generating phase as the first sequence
-        for i in range(len(start_phrase)-1):
-            out, h = model(x_torch[:, i:i+1], h)
-
-        # start generating
-        for _ in range(max_length - len(start_phrase)):
-            out, h = model(x_torch[:, -1:], h)
-            p = F.softmax(out / temperature, dim=-1).data
-
-            # pick top K token by top_k (if defined)
-            if top_k is None:
-                top_char = np.arange(len(vocab))
+    char = x_torch[:, -1:]
+
+    # start generating
+    length = len(start_phrase)
+    while max_length is None or length < max_length:
+        if cancel is not None and cancel.is_set():
+            return
+
+        out, h = model(char, h)
+        char = sample(out[:, -1], temperature, top_k, top_p, greedy, generator).view(1, 1)
+        length += 1
+
+        yield char
+
+def iter_generate(model, vocab, start_phrase='A', max_length=None, temperature=1.0, top_k=None, top_p=None, greedy=False, generator=None, cache=None, stop_on_pad=True, cancel=None):
+    '''Stream generated chars one at a time with constant memory per step.
+    Generation stops at max_length, at <PAD> (if stop_on_pad), once cancel is set
+    or when the caller closes the iterator.
+    -------------------------
+    Parameters:
+    model           : Trained name generator (RNN, LSTM or GRU).
+    vocab           : Map char to int (dict).
+    start_phrase    : First characters of the name (str).
+    max_length      : Maximum name length, start phrase included. Generate
+                      without limit if None (int).
+    temperature     : Softmax temperature. Default to 1.0 (float).
+    top_k           : Sample only from the top K chars if defined (int).
+    top_p           : Sample only from the nucleus of mass top_p if defined (float).
+    greedy          : Always pick the most likely char (bool).
+    generator       : Torch generator for reproducible sampling.
+    cache           : Reuse start phrase hidden state from this cache (PrefixCache).
+    stop_on_pad     : Stop when <PAD> is sampled, otherwise yield it as '' (bool).
+    cancel          : Stop generating once this event is set (threading.Event).
+    '''
+
+    tokens = _iter_tokens(model, vocab, start_phrase, max_length, temperature, top_k, top_p, greedy, generator, cache, cancel)
+    try:
+        for char in tokens:
+            char_id = char.item()
+            if char_id == 0:
+                if stop_on_pad:
+                    return
+                yield ''
             else:
-                p, top_char = p.topk(top_k)
-                top_char = top_char.cpu().numpy().squeeze()
-
-            # select next token and push it to input sequence
-            p = p.cpu().numpy().squeeze()
-            char_id = np.random.choice(top_char, p=p/p.sum())
-            char = torch.tensor([[char_id]], dtype=torch.int64)
-            
-            # make sure generated char in the same device
-            char = char.to(DEVICE)
-            # concat with current input sequence
-            x_torch = torch.cat([x_torch, char], dim=-1)
-
-            # push to char_out
+                yield model.int2char[char_id]
+    finally:
+        tokens.close()
+
+def generate(model, vocab, start_phrase='A', max_length=6, temperature=1.0, top_k=None, top_p=None, greedy=False, generator=None, cache=None):
+    # keep generated tokens on device and move them to host once at the end
+    char_ids = list(_iter_tokens(model, vocab, start_phrase, max_length, temperature, top_k, top_p, greedy, generator, cache, None))
+
+    # create list for output
+    char_out = [start_phrase]
+    if char_ids:
+        for char_id in torch.cat(char_ids, dim=-1).squeeze(0).tolist():
             char_out.append(model.int2char[char_id] if char_id > 0 else '')
 
-        return ''.join(char_out)
+    return ''.join(char_out)
+
+def generate_batch(model, vocab, start_phrases, max_length=6, temperature=1.0, top_k=None, top_p=None, greedy=False, generator=None, cache=None, n=None):
+    '''Generate one name per start phrase, running every row through the model at once.
+    Each step is a single forward pass over the rows still generating, a row finishes
+    when it samples <PAD> (stop token) or reaches max_length.
+    -------------------------
+    Parameters:
+    model           : Trained name generator (RNN, LSTM or GRU).
+    vocab           : Map char to int (dict).
+    start_phrases   : Start phrase for each name (list of str). A single str is
+                      repeated n times.
+    max_length      : Maximum name length, start phrase included (int).
+    temperature     : Softmax temperature. Default to 1.0 (float).
+    top_k           : Sample only from the top K chars if defined (int).
+    top_p           : Sample only from the nucleus of mass top_p if defined (float).
+    greedy          : Always pick the most likely char (bool).
+    generator       : Torch generator for reproducible sampling.
+    cache           : Reuse start phrase hidden states from this cache (PrefixCache).
+    n               : Number of names when start_phrases is a str. Default to 1 (int).
+    '''
+
+    if isinstance(start_phrases, str):
+        start_phrases = [start_phrases] * (n or 1)
 
-if __name__ == '__main__':
+    with torch.no_grad():
+        model = model.to(DEVICE)
 
-    # load vocabs
-    print('Load vocabs...')
-    vocab = pickle.load(open('./models/vocab.pkl', 'rb'))
-    int2char = pickle.load(open('./models/vocab_int2char.pkl', 'rb'))
+        # encode start phrases into a right padded token matrix
+        # that will be filled with generated chars
+        prefix_len = [len(p) for p in start_phrases]
+        width = max([max_length] + prefix_len)
+        tokens = torch.from_numpy(pad_features(encode_words(start_phrases, vocab), seq_length=width))
+        tokens = tokens.to(DEVICE)
+        prefix_len = torch.tensor(prefix_len, device=DEVICE)
+
+        # rows that still have chars to generate
+        active = torch.nonzero(prefix_len < max_length).squeeze(1)
+
+        # end position (exclusive) of each generated name
+        end = prefix_len.clone()
+
+        if cache is None:
+            # init empty hidden state, every row reads its
+            # start phrase from the first char
+            h = None
+            pos = torch.zeros_like(prefix_len)
+        else:
+            # start every row right before the last char of its start phrase
+            states = {p: cache.warmup(model, vocab, p[:-1]) for p in set(start_phrases)}
+            h = _stack_hidden(model, [states[start_phrases[i]] for i in active.tolist()])
+            pos = (prefix_len - 1).clamp(min=0)
+
+        for _ in range(max_length - 1):
+            if len(active) == 0:
+                break
+
+            # feed current char of every active row, either from
+            # its start phrase or sampled in the previous step
+            step = pos[active]
+            out, h = model(tokens[active, step].unsqueeze(1), h)
+            char_id = sample(out[:, -1], temperature, top_k, top_p, greedy, generator)
+
+            # rows still reading their start phrase ignore the sampled char
+            generating = prefix_len[active] <= step + 1
+            rows = active[generating]
+            char_id = char_id[generating]
+            tokens[rows, step[generating] + 1] = char_id
+
+            # a row is done once it samples <PAD> or fills max_length
+            stopped = char_id == 0
+            end[rows[~stopped]] = step[generating][~stopped] + 2
+            done = torch.zeros_like(generating)
+            done[generating] = stopped | (step[generating] + 2 >= max_length)
+            pos[active] += 1
+
+            # drop finished rows so next step only runs the remaining ones
+            keep = ~done
+            active = active[keep]
+            h = _select_hidden(h, keep)
+
+        # decode tokens back to chars
+        names = []
+        for row, n_char in zip(tokens.cpu().tolist(), end.cpu().tolist()):
+            names.append(''.join(model.int2char[i] for i in row[:n_char] if i > 0))
+
+        return names
+
+def _select_hidden(h, index):
+    # LSTM carries (h, c) tuple while RNN and GRU carry a single tensor
+    # hidden state shape is (num_layers, batch_size, hidden_size)
+    if isinstance(h, tuple):
+        return tuple(x[:, index] for x in h)
+    return h[:, index]
+
+def _stack_hidden(model, states):
+    # concat per row hidden states along batch dimension,
+    # missing states (None) start from zeros
+    if not states:
+        return None
+
+    rnn = next(m for m in model.modules() if isinstance(m, nn.RNNBase))
+    zeros = torch.zeros(rnn.num_layers, 1, rnn.hidden_size, device=DEVICE)
+    if isinstance(rnn, nn.LSTM):
+        states = [(zeros, zeros) if h is None else h for h in states]
+        return tuple(torch.cat(x, dim=1) for x in zip(*states))
+
+    return torch.cat([zeros if h is None else h for h in states], dim=1)
 
-    # load model
-    print('Load model checkpoint')
-    path = './models/name_genLSTM.pt'
-    model_weights = load_model(path)
+if __name__ == '__main__':
 
-    # define network
-    print('Apply checkpoints to model...')
-    model = LSTMNameGenerator(len(vocab), HID_SIZE, EMB_SIZE, char2int=vocab, int2char=int2char)
-    model.load_state_dict(model_weights)
+    parser = argparse.ArgumentParser(description='Generate names interactively.')
+    parser.add_argument('--int8', action='store_true', help='Load int8 checkpoint written by quantize.py (CPU only).')
+    parser.add_argument('--bundle', help='Load model and vocab from a bundle written by bundle.py.')
+    parser.add_argument('--bf16', action='store_true', help='Run model under bfloat16 autocast.')
+    args = parser.parse_args()
+
+    if args.bundle:
+        # bundle carries its own architecture and vocab
+        from bundle import load_bundle
+        print('Load model bundle...')
+        model, vocab = load_bundle(args.bundle)
+
+    else:
+        # load vocabs
+        print('Load vocabs...')
+        vocab = load_vocab(VOCAB_PATH)
+        int2char = vocab.int2char
+
+        # define network
+        model = LSTMNameGenerator(len(vocab), HID_SIZE, EMB_SIZE, char2int=vocab, int2char=int2char)
+
+        # load model
+        print('Load model checkpoint')
+        if args.int8:
+            from quantize import load_quantized
+            model = load_quantized(model, QUANT_MODEL_PATH.format('LSTM'))
+        else:
+            path = MODEL_PATH.format('LSTM')
+            model_weights = load_model(path)
+
+            print('Apply checkpoints to model...')
+            model.load_state_dict(model_weights)
 
     # put model to eval mode
     model.eval()
@@ -93,7 +247,9 @@ if __name__ == '__main__':
         if first_char == 'quit':
             break
 
-        for _ in range(total_gen):
-            gen = generate(model, vocab, first_char, max_length=mlength)
+        with autocast(args.bf16):
+            names = generate_batch(model, vocab, first_char, max_length=mlength, n=total_gen)
+
+        for gen in names:
             print(f'Generated name: {gen}', end='\n')
         print('\n')
\ No newline at end of file
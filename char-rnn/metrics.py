@@ -0,0 +1,58 @@
+import torch
+from constant import DEVICE
+
+class Metrics:
+    '''Running loss, accuracy and confusion matrix kept on device.
+    update() never reads values back to host, so it doesn't wait for the
+    device, compute() reads all of them at once, e.g. once per epoch.
+    -------------------------
+    Parameters:
+    num_classes : Number of classes, confusion matrix is skipped if None (int).
+    device      : Device of running sums (torch.device).
+    '''
+
+    def __init__(self, num_classes=None, device=DEVICE):
+        self.num_classes = num_classes
+        self.device = device
+        self.reset()
+
+    def reset(self):
+        self.loss = torch.zeros((), dtype=torch.float64, device=self.device)
+        self.correct = torch.zeros((), dtype=torch.int64, device=self.device)
+        self.confusion = None
+        if self.num_classes is not None:
+            self.confusion = torch.zeros((self.num_classes, self.num_classes), dtype=torch.int64, device=self.device)
+
+        # counted on host, batch sizes are known without sync
+        self.batches = 0
+        self.count = 0
+
+    @torch.no_grad()
+    def update(self, loss, out=None, target=None):
+        '''Add batch mean loss, and accuracy and confusion matrix of
+        logits out (batch_size, num_classes) if target is given.'''
+
+        self.loss += loss.detach()
+        self.batches += 1
+
+        if target is not None:
+            predicted = torch.argmax(out, dim=1)
+            self.correct += (predicted == target).sum()
+            self.count += len(target)
+
+            if self.confusion is not None:
+                # row is actual class, column is predicted class
+                index = target * self.num_classes + predicted
+                self.confusion += torch.bincount(index, minlength=self.num_classes ** 2).view(self.num_classes, self.num_classes)
+
+    def compute(self):
+        '''Read back mean loss (over batches), accuracy (over samples)
+        and confusion matrix, the only host sync.'''
+
+        loss, correct = torch.stack([self.loss, self.correct.to(self.loss.dtype)]).tolist()
+
+        return {
+            'loss': loss / max(self.batches, 1),
+            'acc': correct / self.count if self.count else None,
+            'confusion': self.confusion.cpu() if self.confusion is not None else None
+        }
@@ -1,4 +1,5 @@
 from torch import nn
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 
 # network architecture
 class RNNNameGenerator(nn.Module):
@@ -23,16 +24,24 @@ class RNNNameGenerator(nn.Module):
         # Dropout layer
         self.dropout = nn.Dropout(dropout)
 
-    def forward(self, x, h=None):
+    def forward(self, x, h=None, lengths=None):
         # its optional to init hidden state by ourselves
         # bcs PyTorch will handle it if we don't provide it
 
         # map input to vector
+        total_length = x.size(1)
         x = self.embedding(x)
 
+        # skip <PAD> steps when lengths of the right padded input are given
+        if lengths is not None:
+            x = pack_padded_sequence(x, lengths.cpu().clamp(min=1), batch_first=True, enforce_sorted=False)
+
         # compute current hidden state
         o, h = self.rnn(x, h)
 
+        if lengths is not None:
+            o, _ = pad_packed_sequence(o, batch_first=True, total_length=total_length)
+
         # apply dropout
         o = self.dropout(o)
 
@@ -66,16 +75,24 @@ class LSTMNameGenerator(nn.Module):
         # Dropout layer
         self.dropout = nn.Dropout(dropout)
 
-    def forward(self, x, h=None):
+    def forward(self, x, h=None, lengths=None):
         # its optional to init hidden state by ourselves
         # bcs PyTorch will handle it if we don't provide it
 
         # map input to vector
+        total_length = x.size(1)
         x = self.embedding(x)
 
+        # skip <PAD> steps when lengths of the right padded input are given
+        if lengths is not None:
+            x = pack_padded_sequence(x, lengths.cpu().clamp(min=1), batch_first=True, enforce_sorted=False)
+
         # compute current hidden state
         o, h = self.lstm(x, h)
 
+        if lengths is not None:
+            o, _ = pad_packed_sequence(o, batch_first=True, total_length=total_length)
+
         # apply dropout
         o = self.dropout(o)
 
@@ -109,16 +126,24 @@ class GRUNameGenerator(nn.Module):
         # Dropout layer
         self.dropout = nn.Dropout(dropout)
 
-    def forward(self, x, h=None):
+    def forward(self, x, h=None, lengths=None):
         # its optional to init hidden state by ourselves
         # bcs PyTorch will handle it if we don't provide it
 
         # map input to vector
+        total_length = x.size(1)
         x = self.embedding(x)
 
+        # skip <PAD> steps when lengths of the right padded input are given
+        if lengths is not None:
+            x = pack_padded_sequence(x, lengths.cpu().clamp(min=1), batch_first=True, enforce_sorted=False)
+
         # compute current hidden state
         o, h = self.gru(x, h)
 
+        if lengths is not None:
+            o, _ = pad_packed_sequence(o, batch_first=True, total_length=total_length)
+
         # apply dropout
         o = self.dropout(o)
 
@@ -0,0 +1,122 @@
+import io
+import json
+import random
+import time
+import argparse
+import statistics
+import numpy as np
+import torch
+from torch import nn
+from constant import DATA_PATH, HID_SIZE, EMB_SIZE, MODEL_PATH, QUANT_MODEL_PATH, VOCAB_PATH, CHECKPOINT_DIR, PACKED, STREAMING
+from vocab import load_vocab
+from network import RNNNameGenerator, LSTMNameGenerator, GRUNameGenerator
+
+NETWORKS = {'RNN': RNNNameGenerator, 'LSTM': LSTMNameGenerator, 'GRU': GRUNameGenerator}
+
+def quantize(model):
+    '''Dynamically quantize LSTM, GRU and Linear layers weights to int8.
+    Quantized models only run on CPU. nn.RNN has no dynamic quantized kernel,
+    so RNNNameGenerator only gets its output layer quantized.
+    '''
+
+    model = model.cpu().eval()
+    return torch.ao.quantization.quantize_dynamic(model, {nn.LSTM, nn.GRU, nn.Linear}, dtype=torch.qint8)
+
+def load_quantized(model, path):
+    '''Load int8 checkpoint written by this module into fp32 model instance.'''
+
+    qmodel = quantize(model)
+    # quantized packed weights are not plain tensors, so weights_only can't be used
+    qmodel.load_state_dict(torch.load(path, map_location='cpu', weights_only=False))
+    qmodel.eval()
+
+    return qmodel
+
+def model_size(model):
+    # serialized state_dict size in bytes
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+def latency(fn, repeat=50, warmup=5):
+    # median wall clock time of fn in milliseconds
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(times)
+
+def report(fp32_model, int8_model, vocab, testloader, start_phrase='A', max_length=8, batch_size=256):
+    '''Compare test loss, size and generation latency of fp32 and int8 model.'''
+
+    # imported here so quantize/load_quantized stay light for inference
+    from train import evaluate
+    from inference import generate, generate_batch
+
+    # quantized kernels only run on CPU
+    result = {}
+    for name, model in (('fp32', fp32_model.cpu().eval()), ('int8', int8_model)):
+        result[name] = {
+            'test_loss': evaluate(model, testloader) if testloader is not None else None,
+            'size_bytes': model_size(model),
+            'generate_ms': latency(lambda: generate(model, vocab, start_phrase, max_length)),
+            'generate_batch_ms': latency(lambda: generate_batch(model, vocab, start_phrase, max_length, n=batch_size), repeat=10),
+        }
+
+    result['speedup'] = {k: result['fp32'][k] / result['int8'][k] for k in ('generate_ms', 'generate_batch_ms')}
+    result['batch_size'] = batch_size
+
+    return result
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Quantize trained name generator to int8 and report accuracy and latency.')
+    parser.add_argument('--model', choices=list(NETWORKS), default='LSTM')
+    parser.add_argument('--checkpoint', help='Trained fp32 state_dict, default to MODEL_PATH of the model.')
+    parser.add_argument('--out', help='Output path, default to QUANT_MODEL_PATH of the model.')
+    parser.add_argument('--no-eval', action='store_true', help='Skip test loss, only report size and latency.')
+    parser.add_argument('--seed', type=int, help='Seed of the training run, default to the seed of its latest checkpoint.')
+    args = parser.parse_args()
+
+    # test loss is only meaningful on the split held out by training
+    if not args.no_eval:
+        from checkpoint import training_seed
+        seed = args.seed if args.seed is not None else training_seed(CHECKPOINT_DIR.format(args.model))
+        if seed is None:
+            parser.error('Training seed unknown, pass --seed or --no-eval.')
+
+    checkpoint = args.checkpoint or MODEL_PATH.format(args.model)
+    out = args.out or QUANT_MODEL_PATH.format(args.model)
+
+    # load vocabs
+    print('Load vocabs...')
+    vocab = load_vocab(VOCAB_PATH)
+    int2char = vocab.int2char
+
+    # define network and apply checkpoint
+    print('Apply checkpoints to model...')
+    model = NETWORKS[args.model](len(vocab), HID_SIZE, EMB_SIZE, char2int=vocab, int2char=int2char)
+    model.load_state_dict(torch.load(checkpoint, map_location='cpu'))
+
+    print(f'Quantize model to {out}')
+    qmodel = quantize(model)
+    torch.save(qmodel.state_dict(), out)
+
+    testloader = None
+    if not args.no_eval:
+        from dataloader import load, load_stream
+
+        # same loader, shuffle and split as main.py with this seed
+        random.seed(seed)
+        np.random.seed(seed)
+        (_, testloader), _, _ = (load_stream if STREAMING else load)(DATA_PATH, packed=PACKED)
+
+    result = report(model, qmodel, vocab, testloader)
+    print(json.dumps(result, indent=2))
+    with open(out.replace('.pt', '.json'), 'w') as w:
+        json.dump(result, w, indent=2)
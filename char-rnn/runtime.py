@@ -0,0 +1,107 @@
+'''Minimal inference runtime for models written by export.py.
+Only needs torch (and onnxruntime for ONNX models), training code
+like network.py, dataloader.py or train.py is never imported.
+'''
+import json
+import torch
+from sampling import sample
+
+class NameGeneratorRuntime:
+    '''Batched name generation on top of an exported generation step.
+    -------------------------
+    Parameters:
+    step    : Callable (x, h, c) -> (logits, h, c) on torch tensors.
+    config  : Exported model config, see export.model_config (dict).
+    '''
+
+    def __init__(self, step, config):
+        self.step = step
+        self.config = config
+        self.int2char = config['vocab']
+        self.char2int = {ch: i for i, ch in enumerate(self.int2char)}
+
+    @torch.no_grad()
+    def generate(self, start_phrases, max_length=6, temperature=1.0, top_k=None, top_p=None, greedy=False, generator=None, n=None):
+        '''Generate one name per start phrase, see inference.generate_batch.'''
+
+        if isinstance(start_phrases, str):
+            start_phrases = [start_phrases] * (n or 1)
+
+        # right padded token matrix filled with generated chars
+        prefix_len = torch.tensor([len(p) for p in start_phrases], dtype=torch.int64)
+        width = max([max_length] + prefix_len.tolist())
+        tokens = torch.zeros((len(start_phrases), width), dtype=torch.int64)
+        for i, phrase in enumerate(start_phrases):
+            tokens[i, :len(phrase)] = torch.tensor([self.char2int[ch] for ch in phrase], dtype=torch.int64)
+
+        # rows that still have chars to generate
+        active = torch.nonzero(prefix_len < max_length).squeeze(1)
+        end = prefix_len.clone()
+
+        # zero initial hidden and cell state
+        shape = (self.config['num_layers'], len(active), self.config['hidden_size'])
+        h, c = torch.zeros(shape), torch.zeros(shape)
+
+        for t in range(max_length - 1):
+            if len(active) == 0:
+                break
+
+            logits, h, c = self.step(tokens[active, t:t+1], h, c)
+            char_id = sample(logits, temperature, top_k, top_p, greedy, generator)
+
+            # rows still reading their start phrase ignore the sampled char
+            generating = prefix_len[active] <= t + 1
+            rows = active[generating]
+            char_id = char_id[generating]
+            tokens[rows, t+1] = char_id
+
+            # a row is done once it samples <PAD> or fills max_length
+            stopped = char_id == 0
+            end[rows[~stopped]] = t + 2
+            done = torch.zeros_like(generating)
+            done[generating] = stopped | (t + 2 >= max_length)
+
+            keep = ~done
+            active = active[keep]
+            h, c = h[:, keep], c[:, keep]
+
+        return [''.join(self.int2char[i] for i in row[:n_char] if i > 0)
+                for row, n_char in zip(tokens.tolist(), end.tolist())]
+
+class _OnnxStep:
+    # wrap onnxruntime session to take and return torch tensors
+    def __init__(self, session):
+        self.session = session
+
+    def __call__(self, x, h, c):
+        out = self.session.run(None, {'x': x.numpy(), 'h': h.numpy(), 'c': c.numpy()})
+        return tuple(torch.from_numpy(o) for o in out)
+
+def load_runtime(path):
+    '''Load exported model, format is picked from file extension (.onnx or TorchScript).'''
+
+    if path.endswith('.onnx'):
+        # onnxruntime is only needed for ONNX models, import it lazily
+        import onnxruntime
+
+        session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+        config = json.loads(session.get_modelmeta().custom_metadata_map['config'])
+        return NameGeneratorRuntime(_OnnxStep(session), config)
+
+    extra_files = {'config.json': ''}
+    step = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+    step.eval()
+
+    return NameGeneratorRuntime(step, json.loads(extra_files['config.json']))
+
+if __name__ == '__main__':
+    import sys
+
+    # usage: python runtime.py <exported model> [start phrase] [total names] [max length]
+    runtime = load_runtime(sys.argv[1])
+    start_phrase = sys.argv[2] if len(sys.argv) > 2 else 'A'
+    total_gen = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    mlength = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+
+    for gen in runtime.generate(start_phrase, max_length=mlength, n=total_gen):
+        print(f'Generated name: {gen}')
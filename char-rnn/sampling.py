@@ -0,0 +1,60 @@
+import torch
+from torch.nn import functional as F
+
+def make_generator(seed=None, device='cpu'):
+    '''Create torch random generator for reproducible sampling.
+    -------------------------
+    Parameters:
+    seed    : Random seed, use non-deterministic seed if None (int).
+    device  : Device where sampling happens, must match the logits device.
+    '''
+
+    generator = torch.Generator(device=device)
+    if seed is None:
+        generator.seed()
+    else:
+        generator.manual_seed(seed)
+
+    return generator
+
+def sample(logits, temperature=1.0, top_k=None, top_p=None, greedy=False, generator=None):
+    '''Pick next token for each row of logits without leaving the device.
+    -------------------------
+    Parameters:
+    logits      : Model output of the last step (batch_size, vocab_size).
+    temperature : Softmax temperature, 0 means greedy. Default to 1.0 (float).
+    top_k       : Keep only the K most likely tokens if defined (int).
+    top_p       : Keep the smallest token set whose probability mass
+                  reaches top_p (nucleus sampling) if defined (float).
+    greedy      : Always pick the most likely token (bool).
+    generator   : Torch generator for reproducible sampling.
+    '''
+
+    # greedy decoding doesn't need any probability
+    if greedy or temperature == 0:
+        return logits.argmax(dim=-1)
+
+    # sample in fp32 even if the model runs in bf16
+    logits = logits.float() / temperature
+
+    # pick top K token by top_k (if defined)
+    if top_k is not None:
+        top_k = min(top_k, logits.size(-1))
+        kth = torch.topk(logits, top_k, dim=-1).values[:, -1:]
+        logits = logits.masked_fill(logits < kth, -torch.inf)
+
+    # pick the most likely tokens until their mass reaches top_p (if defined)
+    if top_p is not None and top_p < 1.0:
+        sorted_logits, sorted_id = logits.sort(dim=-1, descending=True)
+        sorted_p = F.softmax(sorted_logits, dim=-1)
+
+        # mass before each token, so the first token is always kept
+        mass = sorted_p.cumsum(dim=-1) - sorted_p
+        sorted_logits = sorted_logits.masked_fill(mass >= top_p, -torch.inf)
+
+        # put filtered logits back to vocab order
+        logits = torch.empty_like(logits).scatter_(-1, sorted_id, sorted_logits)
+
+    p = F.softmax(logits, dim=-1)
+
+    return torch.multinomial(p, 1, generator=generator).squeeze(-1)
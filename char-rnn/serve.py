@@ -0,0 +1,285 @@
+'''HTTP service for name generation.
+
+Concurrent requests are queued and collected into micro-batches of up to
+--max-batch-size names, waiting at most --max-wait-ms for the batch to fill.
+Requests with the same sampling parameters in a batch run as one
+generate_batch() call, so a single model serves many clients at once.
+
+    python serve.py --model LSTM --port 8000
+
+    curl -X POST localhost:8000/generate -H 'Content-Type: application/json' \\
+         -d '{"start_phrase": "Ma", "n": 5, "max_length": 8}'
+    curl localhost:8000/metrics
+'''
+import time
+import asyncio
+import logging
+import argparse
+from typing import Optional
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import torch
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
+from constant import HID_SIZE, EMB_SIZE, MODEL_PATH, QUANT_MODEL_PATH, VOCAB_PATH
+from vocab import load_vocab
+from cache import PrefixCache
+from inference import generate_batch
+from precision import autocast
+from network import RNNNameGenerator, LSTMNameGenerator, GRUNameGenerator
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(name)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+NETWORKS = {'RNN': RNNNameGenerator, 'LSTM': LSTMNameGenerator, 'GRU': GRUNameGenerator}
+
+class GenerateRequest(BaseModel):
+    start_phrase: str = Field('A', min_length=1)
+    n: int = Field(1, ge=1, le=256)
+    max_length: int = Field(6, ge=1, le=64)
+    temperature: float = Field(1.0, gt=0)
+    top_k: Optional[int] = Field(None, ge=1)
+    top_p: Optional[float] = Field(None, gt=0, le=1)
+    greedy: bool = False
+
+@dataclass
+class Pending:
+    # queued request waiting for its batch
+    start_phrase: str
+    n: int
+    params: tuple
+    future: asyncio.Future
+    queued_at: float = field(default_factory=time.perf_counter)
+
+class MicroBatcher:
+    '''Queue generation requests and run them in micro-batches.
+    A batch starts with the first queued request and takes more until it
+    has max_batch_size names or max_wait seconds passed. Requests are
+    grouped by sampling parameters and every group is one generate_batch()
+    call on a single worker thread, so the event loop keeps accepting requests.
+    -------------------------
+    Parameters:
+    model           : Trained name generator (RNN, LSTM or GRU).
+    vocab           : Map char to int (Vocab).
+    max_batch_size  : Maximum names per batch (int).
+    max_wait        : Maximum seconds to wait for a batch to fill (float).
+    cache           : Reuse start phrase hidden states from this cache (PrefixCache).
+    bf16            : Run model under bfloat16 autocast (bool).
+    '''
+
+    def __init__(self, model, vocab, max_batch_size=64, max_wait=0.005, cache=None, bf16=False):
+        self.model = model
+        self.vocab = vocab
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.cache = cache
+        self.bf16 = bf16
+
+        self.queue = None
+        self.task = None
+        # request that didn't fit the previous batch goes first in the next one
+        self.carry = None
+        # model runs on one thread, torch parallelizes inside the batch
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        # metrics
+        self.batch_sizes = Counter()
+        self.requests = 0
+        self.batches = 0
+        self.wait_seconds = 0.
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown()
+
+    async def submit(self, start_phrase, n=1, max_length=6, temperature=1.0, top_k=None, top_p=None, greedy=False):
+        '''Queue request and wait for its n generated names.'''
+
+        future = asyncio.get_running_loop().create_future()
+        params = (max_length, temperature, top_k, top_p, greedy)
+        await self.queue.put(Pending(start_phrase, n, params, future))
+
+        return await future
+
+    async def collect(self):
+        # wait for the first request, then fill batch until full or max_wait passed
+        if self.carry is not None:
+            batch, self.carry = [self.carry], None
+        else:
+            batch = [await self.queue.get()]
+        size = batch[0].n
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+
+        while size < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0 and self.queue.empty():
+                break
+
+            try:
+                # requests already queued are taken even after deadline
+                request = self.queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self.queue.get(), timeout)
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+
+            # keep request that doesn't fit for the next batch
+            if size + request.n > self.max_batch_size:
+                self.carry = request
+                break
+
+            batch.append(request)
+            size += request.n
+
+        return batch
+
+    async def run(self):
+        while True:
+            batch = []
+            try:
+                batch = await self.collect()
+                await self.process(batch)
+            except Exception as e:
+                # fail requests of the broken batch, keep serving the next ones
+                logger.exception('batch failed')
+                for r in batch:
+                    if not r.future.done():
+                        r.future.set_exception(e)
+
+    async def process(self, batch):
+        loop = asyncio.get_running_loop()
+
+        # client may have gone while its request was queued
+        batch = [r for r in batch if not r.future.done()]
+        if not batch:
+            return
+
+        now = time.perf_counter()
+        self.wait_seconds += sum(now - r.queued_at for r in batch)
+        self.requests += len(batch)
+        self.batches += 1
+        self.batch_sizes[sum(r.n for r in batch)] += 1
+
+        # one generate_batch call per group of sampling parameters
+        groups = defaultdict(list)
+        for request in batch:
+            groups[request.params].append(request)
+
+        for (max_length, temperature, top_k, top_p, greedy), requests in groups.items():
+            start_phrases = [r.start_phrase for r in requests for _ in range(r.n)]
+
+            try:
+                names = await loop.run_in_executor(
+                    self.executor, self.generate, start_phrases, max_length, temperature, top_k, top_p, greedy)
+            except Exception as e:
+                # only this group fails, other groups of the batch still run
+                logger.exception('generation failed')
+                for r in requests:
+                    if not r.future.done():
+                        r.future.set_exception(e)
+                continue
+
+            # split names back to their requests
+            i = 0
+            for r in requests:
+                if not r.future.done():
+                    r.future.set_result(names[i:i + r.n])
+                i += r.n
+
+    def generate(self, start_phrases, max_length, temperature, top_k, top_p, greedy):
+        # runs on the worker thread, autocast state is per thread
+        with autocast(self.bf16):
+            return generate_batch(self.model, self.vocab, start_phrases, max_length,
+                                  temperature, top_k, top_p, greedy, cache=self.cache)
+
+    def metrics(self):
+        return {
+            'queue_depth': (self.queue.qsize() if self.queue is not None else 0) + (self.carry is not None),
+            'requests': self.requests,
+            'batches': self.batches,
+            'mean_batch_size': sum(k * v for k, v in self.batch_sizes.items()) / self.batches if self.batches else None,
+            'batch_sizes': dict(sorted(self.batch_sizes.items())),
+            'mean_queue_ms': 1000 * self.wait_seconds / self.requests if self.requests else None,
+            'cache': {'size': len(self.cache), 'hits': self.cache.hits, 'misses': self.cache.misses} if self.cache is not None else None
+        }
+
+def create_app(model, vocab, max_batch_size=64, max_wait=0.005, cache=None, bf16=False):
+    '''Build FastAPI app serving model through a MicroBatcher.'''
+
+    app = FastAPI()
+    app.batcher = MicroBatcher(model, vocab, max_batch_size, max_wait, cache, bf16)
+
+    @app.on_event("startup")
+    async def start_batcher():
+        app.batcher.start()
+
+    @app.on_event("shutdown")
+    async def stop_batcher():
+        await app.batcher.stop()
+
+    @app.get("/")
+    def root():
+        return {"status_code": 200, "message": "Hello!"}
+
+    @app.post("/generate")
+    async def generate(request: GenerateRequest):
+        unknown = sorted(set(request.start_phrase) - set(vocab))
+        if unknown:
+            raise HTTPException(status_code=422, detail=f'Characters not in vocabulary: {unknown}')
+
+        names = await app.batcher.submit(request.start_phrase, request.n, request.max_length,
+                                         request.temperature, request.top_k, request.top_p, request.greedy)
+        return {"names": names}
+
+    @app.get("/metrics")
+    def metrics():
+        return app.batcher.metrics()
+
+    return app
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='Serve name generator over HTTP with micro-batching.')
+    parser.add_argument('--model', choices=list(NETWORKS), default='LSTM')
+    parser.add_argument('--checkpoint', help='Trained state_dict, default to MODEL_PATH of the model.')
+    parser.add_argument('--int8', action='store_true', help='Load int8 checkpoint written by quantize.py.')
+    parser.add_argument('--bundle', help='Load model and vocab from a bundle written by bundle.py.')
+    parser.add_argument('--max-batch-size', type=int, default=64, help='Maximum names per batch.')
+    parser.add_argument('--max-wait-ms', type=float, default=5, help='Maximum wait for a batch to fill.')
+    parser.add_argument('--cache-size', type=int, default=1024, help='Cached start phrases, 0 to disable.')
+    parser.add_argument('--bf16', action='store_true', help='Run model under bfloat16 autocast.')
+    parser.add_argument('--threads', type=int, help='Torch threads.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    # load vocab and model
+    if args.bundle:
+        from bundle import load_bundle
+        model, vocab = load_bundle(args.bundle)
+    else:
+        vocab = load_vocab(VOCAB_PATH)
+        model = NETWORKS[args.model](len(vocab), HID_SIZE, EMB_SIZE, char2int=vocab, int2char=vocab.int2char)
+
+        if args.int8:
+            from quantize import load_quantized
+            model = load_quantized(model, args.checkpoint or QUANT_MODEL_PATH.format(args.model))
+        else:
+            model.load_state_dict(torch.load(args.checkpoint or MODEL_PATH.format(args.model), map_location='cpu'))
+    model.eval()
+
+    cache = PrefixCache(args.cache_size) if args.cache_size > 0 else None
+    app = create_app(model, vocab, args.max_batch_size, args.max_wait_ms / 1000, cache, args.bf16)
+
+    uvicorn.run(app, host=args.host, port=args.port)
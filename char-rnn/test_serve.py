@@ -0,0 +1,44 @@
+import asyncio
+import pytest
+from serve import MicroBatcher
+
+class StubBatcher(MicroBatcher):
+    # generates start phrase + 'a' without a model, fails the first fail_process batches
+    def __init__(self, fail_process=0, fail_generate=0):
+        super().__init__(model=None, vocab=None, max_wait=0.001)
+        self.fail_process = fail_process
+        self.fail_generate = fail_generate
+
+    async def process(self, batch):
+        if self.fail_process:
+            self.fail_process -= 1
+            raise RuntimeError('injected batch failure')
+        await super().process(batch)
+
+    def generate(self, start_phrases, *args):
+        if self.fail_generate:
+            self.fail_generate -= 1
+            raise RuntimeError('injected generation failure')
+        return [phrase + 'a' for phrase in start_phrases]
+
+async def serve(batcher, *requests):
+    # submit requests one after another, return result or exception of each
+    batcher.start()
+    try:
+        results = []
+        for start_phrase in requests:
+            try:
+                results.append(await asyncio.wait_for(batcher.submit(start_phrase, n=2), 1))
+            except RuntimeError as e:
+                results.append(e)
+        return results
+    finally:
+        await batcher.stop()
+
+@pytest.mark.parametrize('failure', ['fail_process', 'fail_generate'])
+def test_request_succeeds_after_failure(failure):
+    batcher = StubBatcher(**{failure: 1})
+    failed, names = asyncio.run(serve(batcher, 'A', 'Ma'))
+
+    assert isinstance(failed, RuntimeError)
+    assert names == ['Maa', 'Maa']
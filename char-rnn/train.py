@@ -1,12 +1,77 @@
 import torch
+from contextlib import nullcontext
 from torch.optim import Adam
 from torch import nn
-from constant import ES, DEVICE, MODEL_PATH
+import torch.distributed as dist
+from constant import ES, DEVICE, MODEL_PATH, BF16
+from instrument import NullMonitor
+from metrics import Metrics
+from checkpoint import rng_state, set_rng_state
+from precision import autocast
 from tqdm import tqdm
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-def train(model, trainloader, valloader=None, epochs=500, lr=.001, print_every=100, grad_clip=5, save_path=MODEL_PATH.format('')):
+def compute_loss(model, batch, criterion):
+    '''Compute next char loss of one batch from the DataLoader.
+    Batches made for packed training also carry name lengths, then the
+    RNN skips <PAD> steps and only the first <PAD> after each name
+    (end of name) is kept as target, the remaining ones are ignored.
+    '''
+
+    # transform datatype and move to device
+    feature = batch[0].type(torch.LongTensor).to(DEVICE)
+
+    if len(batch) == 1:
+        # forward pass
+        out, _ = model(feature)
+        pred = out[:, :-1]
+        actual = feature[:, 1:]
+
+    else:
+        lengths = batch[1]
+
+        # trim padding shared by the whole batch, but keep
+        # one <PAD> after the longest name as its end target
+        width = min(int(lengths.max()) + 1, feature.size(1))
+        feature = feature[:, :width]
+
+        # forward pass over real chars only
+        out, _ = model(feature, lengths=lengths)
+        pred = out[:, :-1]
+
+        # ignore targets after the end of each name
+        position = torch.arange(width - 1, device=DEVICE)
+        ignored = position >= lengths.to(DEVICE).unsqueeze(1)
+        actual = feature[:, 1:].masked_fill(ignored, criterion.ignore_index)
+
+    # compute loss
+    # example:
+    # input = 'maxim'
+    # out     = ['m', 'a', 'x', 'i']
+    # feature = ['a', 'x', 'i', 'm']
+    vocab_size = getattr(model, 'module', model).vocab_size
+    return criterion(pred.contiguous().view(-1, vocab_size),
+                     actual.contiguous().view(-1))
+
+def is_main_process():
+    # only the first process logs and saves in distributed training
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+def mean_loss(total, count):
+    # average loss over batches of every process in distributed training
+    if dist.is_initialized():
+        t = torch.tensor([total, count], dtype=torch.float64)
+        dist.all_reduce(t)
+        total, count = t.tolist()
+
+    return total / count
+
+def batch_tokens(batch):
+    # chars the model steps over, packed batches skip <PAD> steps
+    return int(batch[1].sum()) if len(batch) > 1 else batch[0].numel()
+
+def train(model, trainloader, valloader=None, epochs=500, lr=.001, print_every=100, grad_clip=5, save_path=MODEL_PATH.format(''), callback=None, monitor=None, checkpoint=None, resume=None, bf16=BF16):
 
     # dict to store training logs
     history = {
@@ -25,59 +90,73 @@ def train(model, trainloader, valloader=None, epochs=500, lr=.001, print_every=1
     # early stop trigger
     es_trigger = 0
     val_loss_min = torch.inf
-
-    # setup epoch tqdm
-    epochloop = tqdm(range(epochs), position=0, desc='Training', leave=True)
+    start_epoch = 0
+
+    # continue from full training state, see checkpoint.CheckpointManager
+    if resume is not None:
+        getattr(model, 'module', model).load_state_dict(resume['model'])
+        optim.load_state_dict(resume['optimizer'])
+        es_trigger, val_loss_min = resume['es_trigger'], resume['val_loss_min']
+        history = {**resume['history'], 'epochs': epochs}
+        start_epoch = resume['epoch'] + 1
+        set_rng_state(resume['rng'])
+
+    # setup epoch tqdm, in distributed training only first process reports
+    main_process = is_main_process()
+    epochloop = tqdm(range(start_epoch, epochs), position=0, desc='Training', leave=True, disable=not main_process)
+    log = epochloop.write if main_process else lambda msg: None
+
+    # records phase timing and throughput, see instrument.TrainingMonitor
+    if monitor is None:
+        monitor = NullMonitor()
 
     for e in epochloop:
 
+        # reshuffle distributed, bucketed or streamed batches for this epoch
+        for sampler in (trainloader.sampler, trainloader.batch_sampler, trainloader.dataset):
+            if hasattr(sampler, 'set_epoch'):
+                sampler.set_epoch(e)
+
         #################
         # training mode #
         #################
 
         model.train()
+        monitor.start_epoch()
 
-        # running loss
-        train_loss = 0
-
-        for feature in trainloader:
-            # transform datatype
-            feature = feature[0]
-            feature = feature.type(torch.LongTensor)
-
-            # move to device
-            feature = feature.to(DEVICE)
+        # running loss, kept on device
+        train_metrics = Metrics()
 
-            # reset optimizer
-            optim.zero_grad()
+        # streamed shards can give processes a different number of batches,
+        # join() lets processes that ran out shadow the collectives of the others
+        with (model.join() if isinstance(model, nn.parallel.DistributedDataParallel) else nullcontext()):
+            for batch in monitor.timed(trainloader):
+                # reset optimizer
+                optim.zero_grad()
 
-            # forward pass
-            out, _ = model(feature)
-            pred = out[:, :-1]
-            actual = feature[:, 1:]
+                # forward pass and compute loss, in bf16 if enabled
+                with monitor.phase('forward'), autocast(bf16):
+                    loss = compute_loss(model, batch, criterion)
 
-            # compute loss
-            # example:
-            # input = 'maxim'
-            # out     = ['m', 'a', 'x', 'i']
-            # feature = ['a', 'x', 'i', 'm']
-            loss = criterion(pred.contiguous().view(-1, model.vocab_size),
-                             actual.contiguous().view(-1))
+                #  backpropagate
+                with monitor.phase('backward'):
+                    loss.backward()
 
-            #  backpropagate
-            loss.backward()
+                with monitor.phase('optimizer'):
+                    # clip gradient
+                    nn.utils.clip_grad_norm_(model.parameters(), grad_clip)
 
-            # clip gradient
-            nn.utils.clip_grad_norm_(model.parameters(), grad_clip)
+                    # update optimizer
+                    optim.step()
 
-            # update optimizer
-            optim.step()
+                # write loss
+                train_metrics.update(loss)
 
-            # write loss
-            train_loss += loss.item()
+                monitor.step(e, len(batch[0]), batch_tokens(batch))
 
         # write history loss
-        history['train_loss'].append(train_loss / len(trainloader))
+        train_loss = mean_loss(float(train_metrics.loss), train_metrics.batches)
+        history['train_loss'].append(train_loss)
 
 
         ####################
@@ -86,61 +165,96 @@ def train(model, trainloader, valloader=None, epochs=500, lr=.001, print_every=1
 
         model.eval()
 
-        # eval loss
-        val_loss = 0
-
-        with torch.no_grad():
-            for feature in valloader:
-                # transform datatype
-                feature = feature[0].type(torch.LongTensor)
-
-                # move to device
-                feature = feature.to(DEVICE)
-
-                # forward pass
-                out, _ = model(feature)
-                pred = out[:, :-1]
-                actual = feature[:, 1:]
+        # eval loss, kept on device
+        val_metrics = Metrics()
 
-                # compute loss
-                loss = criterion(pred.contiguous().view(-1, model.vocab_size),
-                                 actual.contiguous().view(-1))
+        with torch.no_grad(), monitor.phase('validation'), autocast(bf16):
+            for batch in valloader:
+                # forward pass and compute loss
+                loss = compute_loss(model, batch, criterion)
 
                 # write loss
-                val_loss += loss.item()
+                val_metrics.update(loss)
 
         # write loss history
-        history['val_loss'].append(val_loss / len(valloader))
+        val_loss = mean_loss(float(val_metrics.loss), val_metrics.batches)
+        history['val_loss'].append(val_loss)
+        monitor.epoch_end(e, train_loss=train_loss, val_loss=val_loss)
 
         # put back model to train mode
         model.train()
 
         # add epoch meta info
-        epochloop.set_postfix_str(f'Val Loss: {val_loss / len(valloader):.3f}')
+        epochloop.set_postfix_str(f'Val Loss: {val_loss:.3f}')
 
         # print epoch
+        improved = False
         if (e+1) % print_every == 0 or e == 0:
-            epochloop.write(f'Epoch {e+1}/{epochs} | Train Loss: {train_loss/len(trainloader):.4f} | Val Loss: {val_loss/len(valloader):.4f}')
+            log(f'Epoch {e+1}/{epochs} | Train Loss: {train_loss:.4f} | Val Loss: {val_loss:.4f}')
             epochloop.update()
 
             # save model if validation loss decrease
-            if val_loss / len(valloader) <= val_loss_min:
-                torch.save(model.state_dict(), save_path)
-                val_loss_min = val_loss / len(valloader)
+            if val_loss <= val_loss_min:
+                # checkpoint manager writes weights in background instead
+                if main_process and checkpoint is None:
+                    torch.save(getattr(model, 'module', model).state_dict(), save_path)
+                val_loss_min = val_loss
                 es_trigger = 0
+                improved = True
             else:
-                epochloop.write(f'[WARNING] Loss did not improving ({val_loss_min:.4f} --> {val_loss/len(valloader):.4f})')
+                log(f'[WARNING] Loss did not improving ({val_loss_min:.4f} --> {val_loss:.4f})')
                 es_trigger += 1
 
-            # force early stop
-            if es_trigger >= 5:
-                epochloop.write(f'Early stopped at Epoch-{e}')
-                # update epochs history
-                history['epochs'] = e+1
-                break
+        # save everything needed to resume after this epoch
+        if main_process and checkpoint is not None:
+            checkpoint.save({
+                'model': getattr(model, 'module', model).state_dict(),
+                'optimizer': optim.state_dict(),
+                'epoch': e,
+                'es_trigger': es_trigger,
+                'val_loss_min': val_loss_min,
+                'history': history,
+                'rng': rng_state()
+            }, e, is_best=improved)
+
+        # force early stop
+        if es_trigger >= 5:
+            log(f'Early stopped at Epoch-{e}')
+            # update epochs history
+            history['epochs'] = e+1
+            break
+
+        # stop when callback asks to, e.g. trial pruned by a sweep
+        if callback is not None and callback(e, history):
+            log(f'Stopped by callback at Epoch-{e}')
+            history['epochs'] = e+1
+            break
+
+    # finish pending checkpoint write
+    if checkpoint is not None:
+        checkpoint.wait()
 
     return model, history    
 
+def evaluate(model, loader, bf16=BF16):
+    '''Compute mean next char loss of model over loader.'''
+
+    model = model.to(DEVICE)
+    model.eval()
+
+    criterion = nn.CrossEntropyLoss()
+
+    # eval loss, kept on device
+    eval_metrics = Metrics()
+
+    with torch.no_grad(), autocast(bf16):
+        for batch in loader:
+            # forward pass and compute loss
+            loss = compute_loss(model, batch, criterion)
+            eval_metrics.update(loss)
+
+    return eval_metrics.compute()['loss']
+
 def plot_loss(history):
     # history loss
     plt.figure(figsize=(6, 8))
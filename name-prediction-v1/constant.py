@@ -14,4 +14,6 @@ PRINT_EVERY = 10
 LOG_EVERY = 1000    # we can consider it as batch size
 LOG_LEVEL='PROD'
 MODEL_NAME = 'model.pt'
-EARLY_STOP = 5
\ No newline at end of file
+EARLY_STOP = 5
+METRICS_PATH = 'metrics.jsonl'  # training throughput log, None to disable
+PROFILE_STEPS = None            # steps (start, end) traced by torch.profiler
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import torch
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+def peak_rss_mb():
+    # peak resident memory of this process, ru_maxrss is in KB on Linux
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class TrainingMonitor:
+    '''Record where training time goes and write it as JSONL.
+    Every epoch writes one record with time spent per phase (data, forward,
+    backward, optimizer, validation), samples/sec, tokens/sec and peak RSS.
+    Per step records are written too if log_steps.
+    -------------------------
+    Parameters:
+    path            : JSONL output file (str).
+    log_steps       : Also write one record per training step (bool).
+    profile_steps   : Wrap global steps [start, end) in torch.profiler and
+                      export a chrome trace, disabled if None (tuple of int).
+    trace_path      : Chrome trace output file (str).
+    '''
+
+    def __init__(self, path, log_steps=False, profile_steps=None, trace_path='./models/trace.json'):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path, 'a')
+        self.log_steps = log_steps
+        self.global_step = 0
+
+        # cuda kernels run async, so wait for them before reading the clock
+        self.sync = torch.cuda.synchronize if torch.cuda.is_available() else lambda: None
+
+        self.start_epoch()
+
+        self.profiler = None
+        if profile_steps is not None:
+            start, end = profile_steps
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+            self.profiler = torch.profiler.profile(
+                activities=activities,
+                schedule=torch.profiler.schedule(wait=max(start - 1, 0), warmup=min(start, 1), active=end - start, repeat=1),
+                on_trace_ready=lambda prof: prof.export_chrome_trace(trace_path),
+                record_shapes=True)
+            self.profiler.start()
+
+    def start_epoch(self):
+        '''Reset counters and restart epoch clock, so time outside
+        the epoch loop isn't counted.'''
+
+        self.phases = {}
+        self._step_phases = {}
+        self.samples = 0
+        self.tokens = 0
+        self.steps = 0
+        self.epoch_start = time.perf_counter()
+
+    def _add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+        self._step_phases[name] = self._step_phases.get(name, 0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        '''Time block of code as phase name.'''
+
+        self.sync()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sync()
+            self._add(name, time.perf_counter() - start)
+
+    def timed(self, loader, name='data'):
+        '''Iterate loader, timing each batch fetch as phase name.'''
+
+        batches = iter(loader)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(batches)
+            except StopIteration:
+                return
+            self._add(name, time.perf_counter() - start)
+
+            yield batch
+
+    def step(self, epoch, samples, tokens):
+        '''Mark the end of one training step.'''
+
+        self.samples += samples
+        self.tokens += tokens
+        self.steps += 1
+
+        if self.log_steps:
+            self._write({'type': 'step', 'epoch': epoch, 'step': self.global_step,
+                         'samples': samples, 'tokens': tokens, **self._step_phases})
+
+        self._step_phases = {}
+        self.global_step += 1
+
+        if self.profiler is not None:
+            self.profiler.step()
+
+    def epoch_end(self, epoch, **metrics):
+        '''Write epoch summary and start counting the next epoch.'''
+
+        seconds = time.perf_counter() - self.epoch_start
+        train_seconds = seconds - self.phases.get('validation', 0)
+
+        self._write({
+            'type': 'epoch',
+            'epoch': epoch,
+            'seconds': seconds,
+            'steps': self.steps,
+            'phases': self.phases,
+            'samples_per_sec': self.samples / train_seconds if train_seconds else None,
+            'tokens_per_sec': self.tokens / train_seconds if train_seconds else None,
+            'peak_rss_mb': peak_rss_mb(),
+            **metrics
+        })
+
+        self.start_epoch()
+
+    def close(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
+        self.file.close()
+
+    def _write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+class NullMonitor:
+    '''Monitor with the same interface that records nothing.'''
+
+    def start_epoch(self):
+        pass
+
+    def phase(self, name):
+        return nullcontext()
+
+    def timed(self, loader, name='data'):
+        return loader
+
+    def step(self, epoch, samples, tokens):
+        pass
+
+    def epoch_end(self, epoch, **metrics):
+        pass
+
+    def close(self):
+        pass
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Summarize training throughput log.')
+    parser.add_argument('path', nargs='?', default='./models/metrics.jsonl')
+    args = parser.parse_args()
+
+    # print time share of every phase per epoch
+    for line in open(args.path):
+        record = json.loads(line)
+        if record['type'] != 'epoch':
+            continue
+
+        share = ' | '.join(f'{k}: {v / record["seconds"]:.0%}' for k, v in record['phases'].items())
+        print(f"Epoch {record['epoch']+1} | {record['seconds']:.2f}s | {record['samples_per_sec']:.0f} samples/s | "
+              f"{record['tokens_per_sec']:.0f} tokens/s | {share}")
@@ -2,8 +2,9 @@ from network import NameRNN
 from dataloader import load_data, split
 import torch
 from torch.optim import Adam
-from constant import EPOCH, LEARNING_RATE, N_LETTERS, PRINT_EVERY, TEST_SIZE, VAL_SIZE, DATA_PATH, DEVICE, LOG_EVERY
+from constant import EPOCH, LEARNING_RATE, N_LETTERS, PRINT_EVERY, TEST_SIZE, VAL_SIZE, DATA_PATH, DEVICE, LOG_EVERY, METRICS_PATH, PROFILE_STEPS
 from train import training
+from instrument import TrainingMonitor
 import time
 
 
@@ -29,9 +30,15 @@ if __name__ == '__main__':
     # model initialization
     network = NameRNN(N_LETTERS, hidden_size, n_categories)    
     
+    # record training throughput
+    monitor = TrainingMonitor(METRICS_PATH, profile_steps=PROFILE_STEPS, trace_path='trace.json') if METRICS_PATH else None
+
     # train
     print('Training start...')
     start = time.time()
-    result = training(network, labels, train, val, DEVICE, EPOCH, LEARNING_RATE, PRINT_EVERY, LOG_EVERY)
+    result = training(network, labels, train, val, DEVICE, EPOCH, LEARNING_RATE, PRINT_EVERY, LOG_EVERY, monitor=monitor)
     print(f'Training done. Time elapsed {time.time() - start:.2f} second')
+
+    if monitor is not None:
+        monitor.close()
     
\ No newline at end of file
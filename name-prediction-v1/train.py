@@ -5,8 +5,9 @@ from tqdm import tqdm
 from dataloader import get_batches
 from utils import output_to_label
 from constant import LOG_LEVEL, MODEL_NAME, EARLY_STOP
+from instrument import NullMonitor
 
-def training(model, all_labels, train_data, val_data, device, epochs=1000, lr=.05, print_every=100, log_every=100):
+def training(model, all_labels, train_data, val_data, device, epochs=1000, lr=.05, print_every=100, log_every=100, monitor=None):
     '''docstring'''
 
     # set model to train mode
@@ -28,18 +29,24 @@ def training(model, all_labels, train_data, val_data, device, epochs=1000, lr=.0
     # validation loss minimum
     val_loss_min = torch.inf
 
+    # records phase timing and throughput, see instrument.TrainingMonitor
+    if monitor is None:
+        monitor = NullMonitor()
+
     for e in tqdm(range(epochs), desc='Epoch', ncols=75):
         ####################
         # Training Section #
         ####################
 
 
+        monitor.start_epoch()
+
         # define local loss and acc
         tloss = 0
         tacc = []
 
         # load our batch data
-        for tid, (feature, target) in enumerate(get_batches(train_data, all_labels)):
+        for tid, (feature, target) in enumerate(monitor.timed(get_batches(train_data, all_labels))):
             # init hidden state
             hidden = model.init_hidden(device)
 
@@ -49,15 +56,16 @@ def training(model, all_labels, train_data, val_data, device, epochs=1000, lr=.0
             # reset optimizer
             optimizer.zero_grad()
 
-            # forward pass for each char sequences
-            for row in feature:
-                # add dimension to feature
-                row = row.view(1, -1)
-                # forward pass and update our hidden state
-                output, hidden = model(row, hidden)
+            with monitor.phase('forward'):
+                # forward pass for each char sequences
+                for row in feature:
+                    # add dimension to feature
+                    row = row.view(1, -1)
+                    # forward pass and update our hidden state
+                    output, hidden = model(row, hidden)
 
-            # compute loss
-            loss = criterion(output, target)            
+                # compute loss
+                loss = criterion(output, target)            
             # record local loss       
             tloss += loss.item()
             # compute accuracy
@@ -73,9 +81,13 @@ def training(model, all_labels, train_data, val_data, device, epochs=1000, lr=.0
                 tloss = 0
 
             # backpropagation
-            loss.backward()
+            with monitor.phase('backward'):
+                loss.backward()
             # update weights
-            optimizer.step()
+            with monitor.phase('optimizer'):
+                optimizer.step()
+
+            monitor.step(e, 1, len(feature))
         
         train_acc.append(sum(tacc)/len(tacc))
 
@@ -94,7 +106,7 @@ def training(model, all_labels, train_data, val_data, device, epochs=1000, lr=.0
 
         # we turned off gradient on validation mode
         # we also won't perform backpropagation and optimization
-        with torch.no_grad():
+        with torch.no_grad(), monitor.phase('validation'):
             # load our batch data
             for vid, (feature, target) in enumerate(get_batches(val_data, all_labels)):
                 # init hidden state
@@ -125,6 +137,8 @@ def training(model, all_labels, train_data, val_data, device, epochs=1000, lr=.0
                         
             val_acc.append(sum(vacc)/len(vacc))
 
+        monitor.epoch_end(e, train_acc=train_acc[-1], val_acc=val_acc[-1])
+
         # reset model to train mode
         model.train()
 
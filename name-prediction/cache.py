@@ -0,0 +1,159 @@
+import os
+import time
+import threading
+import numpy as np
+from collections import OrderedDict, Counter
+from constant import PACKED, SEQ_LENGTH
+from predict import predict_batch
+
+def checkpoint_version(path):
+    # cheap version of a checkpoint file, changes whenever the file is rewritten
+    stat = os.stat(path)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+def normalize_name(name):
+    # same name with different surrounding or repeated spaces is one entry
+    return ' '.join(name.split())
+
+class CachedPredictor:
+    '''Classify names with an LRU cache of normalized name to top k labels
+    and probabilities in front of the model, for skewed traffic where a few
+    names make most requests. Safe to share between threads, the lock is
+    only held for cache lookups, never during the forward pass.
+    -------------------------
+    Parameters:
+    model       : Trained classifier in eval mode (NameRNN, NameLSTM or NameGRU).
+    vocab       : Map char to int (Vocab).
+    labels      : Class names in output order (list of str).
+    k           : Number of most probable labels per name (int).
+    capacity    : Maximum number of cached names (int).
+    ttl         : Seconds an entry stays valid, forever if None (float).
+    version     : Version of the model weights, e.g. checkpoint_version() of
+                  its checkpoint. Entries of another version are never returned (str).
+    normalize   : Map name to the cache key and model input (callable).
+    packed      : Model was trained on packed sequences (bool).
+    seq_length  : Padded name length, same as training (int).
+    '''
+
+    def __init__(self, model, vocab, labels, k=1, capacity=10000, ttl=None, version=None,
+                 normalize=normalize_name, packed=PACKED, seq_length=SEQ_LENGTH):
+        self.model = model
+        self.vocab = vocab
+        self.labels = labels
+        self.k = k
+        self.capacity = capacity
+        self.ttl = ttl
+        self.version = version
+        self.normalize = normalize
+        self.packed = packed
+        self.seq_length = seq_length
+
+        # name -> (version, expires at, top labels, top probs)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # stats
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def reload(self, model, version):
+        '''Swap model weights, cached results of an older version are dropped.'''
+
+        with self._lock:
+            self.model = model
+            if version != self.version:
+                self.version = version
+                self._entries.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get(self, name, now):
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+
+        if entry[0] != self.version or (entry[1] is not None and entry[1] <= now):
+            del self._entries[name]
+            self.expired += 1
+            return None
+
+        # most recently used goes last
+        self._entries.move_to_end(name)
+        return entry[2], entry[3]
+
+    def _put(self, name, version, top_labels, top_probs, now):
+        # result of a model swapped out during the forward pass is stale
+        if version != self.version:
+            return
+
+        expires = now + self.ttl if self.ttl is not None else None
+        self._entries[name] = (version, expires, top_labels, top_probs)
+        self._entries.move_to_end(name)
+
+        # evict least recently used until cache fits capacity
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def predict_batch(self, names):
+        '''Top k labels (list of list of str) and probabilities (np.ndarray
+        of shape (len(names), k)) of names, same as predict.predict_batch.
+        Only names missing from the cache go through the model, once each.
+        '''
+
+        keys = [self.normalize(name) for name in names]
+        results = {}
+
+        counts = Counter(keys)
+        with self._lock:
+            now = time.monotonic()
+            for key in counts:
+                result = self._get(key, now)
+                if result is not None:
+                    results[key] = result
+
+            missing = [key for key in counts if key not in results]
+            n_missing = sum(counts[key] for key in missing)
+            self.hits += len(keys) - n_missing
+            self.misses += n_missing
+            model, version = self.model, self.version
+
+        # forward pass of every missing name at once, outside the lock
+        if missing:
+            top_labels, top_probs = predict_batch(model, missing, self.vocab, self.labels, self.k,
+                                                  self.seq_length, self.packed)
+
+            with self._lock:
+                now = time.monotonic()
+                for key, label, prob in zip(missing, top_labels, top_probs):
+                    # copy row, so the entry doesn't keep the whole batch alive
+                    results[key] = (label, prob.copy())
+                    self._put(key, version, *results[key], now)
+
+        return [results[key][0] for key in keys], np.stack([results[key][1] for key in keys])
+
+    def predict(self, name):
+        # top k labels and probabilities of a single name
+        top_labels, top_probs = self.predict_batch([name])
+        return top_labels[0], top_probs[0]
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else None,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'version': self.version
+            }
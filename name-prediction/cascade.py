@@ -0,0 +1,339 @@
+'''Cascade of a fast char n-gram classifier in front of the RNN.
+
+The fast model is a linear classifier over hashed char n-grams, trained on
+the corpus labels or distilled from a trained RNN, and runs in NumPy only.
+Names it classifies with probability >= --threshold are answered by it,
+the rest go through the RNN. The benchmark reports the share of names served
+by the fast path, latency and accuracy against the RNN alone.
+
+    python cascade.py --model GRU --distill
+'''
+import time
+import json
+import argparse
+import numpy as np
+import torch
+from constant import DATA_PATH, HID_SIZE, EMB_SIZE, MODEL_PATH, VOCAB_PATH, NGRAM_PATH, PACKED, SEQ_LENGTH, CHECKPOINT_DIR
+from predict import encode_batch
+
+# 64 bit FNV-1a over unicode code points
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+
+# marks name start and end, so prefixes and suffixes get their own n-grams
+BOS, EOS = '\x02', '\x03'
+
+def ngram_features(names, ngram_range=(1, 4), n_buckets=2**17):
+    '''Hash every char n-gram of names into n_buckets, without looping over names.
+    Returns bucket ids of all n-grams grouped by name, and index of the first
+    n-gram of each name and n-gram count per name (both of shape (len(names),)).
+    '''
+
+    # every char as its code point, utf-32 has fixed 4 bytes per char
+    text = ''.join(BOS + name + EOS for name in names)
+    code_points = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    lengths = np.array([len(name) + 2 for name in names], dtype=np.int64)
+
+    # name and position inside the name of every char
+    rows = np.repeat(np.arange(len(names)), lengths)
+    position = np.arange(len(code_points)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    remaining = np.repeat(lengths, lengths) - position
+
+    all_rows, all_ids = [], []
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        m = len(code_points) - n + 1
+        if m <= 0:
+            continue
+
+        # hash of the n-gram starting at every char, n is part of the hash
+        h = np.full(m, FNV_OFFSET ^ np.uint64(n))
+        for j in range(n):
+            h = (h ^ code_points[j:j + m]) * FNV_PRIME
+        h ^= h >> np.uint64(29)
+
+        # only n-grams that end inside their name
+        valid = remaining[:m] >= n
+        all_rows.append(rows[:m][valid])
+        all_ids.append((h[valid] % np.uint64(n_buckets)).astype(np.int64))
+
+    # group n-grams by name
+    rows = np.concatenate(all_rows)
+    order = np.argsort(rows, kind='stable')
+    counts = np.bincount(rows, minlength=len(names))
+
+    return np.concatenate(all_ids)[order], np.cumsum(counts) - counts, counts
+
+def softmax(logits):
+    e = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+class NgramClassifier:
+    '''Linear softmax classifier over the mean of hashed char n-gram weights,
+    like fastText without hidden layer. Training and prediction are NumPy only.
+    -------------------------
+    Parameters:
+    num_classes : Number of classes (int).
+    n_buckets   : Hash buckets of n-grams, collisions share a weight (int).
+    ngram_range : Smallest and largest n-gram length (tuple of int).
+    '''
+
+    def __init__(self, num_classes, n_buckets=2**17, ngram_range=(1, 4)):
+        self.num_classes = num_classes
+        self.n_buckets = n_buckets
+        self.ngram_range = tuple(ngram_range)
+
+        self.weight = np.zeros((n_buckets, num_classes), dtype=np.float32)
+        self.bias = np.zeros(num_classes, dtype=np.float32)
+
+    def logits(self, names):
+        ids, starts, counts = ngram_features(names, self.ngram_range, self.n_buckets)
+
+        # mean weight of the n-grams of every name, names always have n-grams
+        return np.add.reduceat(self.weight[ids], starts, axis=0) / counts[:, None] + self.bias
+
+    def predict_proba(self, names):
+        return softmax(self.logits(names))
+
+    def fit(self, names, targets, epochs=20, lr=20., batch_size=16, seed=0):
+        '''Train with mini-batch SGD and linearly decaying learning rate.
+        -------------------------
+        Parameters:
+        names       : Training names (list of str).
+        targets     : Class index of each name (1D int array), or class
+                      probabilities (2D array) to distill from a teacher.
+        epochs      : Passes over names (int).
+        lr          : Initial learning rate, large bcs gradients are
+                      spread over the n-grams of a name (float).
+        batch_size  : Names per step (int).
+        seed        : Shuffle seed (int).
+        '''
+
+        targets = np.asarray(targets)
+        if targets.ndim == 1:
+            targets = np.eye(self.num_classes, dtype=np.float32)[targets]
+
+        rng = np.random.default_rng(seed)
+        names = np.array(names, dtype=object)
+        n_steps = epochs * ((len(names) + batch_size - 1) // batch_size)
+
+        step = 0
+        for _ in range(epochs):
+            index = rng.permutation(len(names))
+            for i in range(0, len(index), batch_size):
+                batch = index[i:i + batch_size]
+                ids, starts, counts = ngram_features(list(names[batch]), self.ngram_range, self.n_buckets)
+
+                # gradient of mean cross entropy w.r.t. logits
+                logits = np.add.reduceat(self.weight[ids], starts, axis=0) / counts[:, None] + self.bias
+                grad = (softmax(logits) - targets[batch]) / len(batch)
+
+                # every n-gram gets its name's gradient over the n-gram count,
+                # summed per bucket, so repeated buckets are updated once
+                values = np.repeat(grad / counts[:, None], counts, axis=0)
+                order = np.argsort(ids, kind='stable')
+                buckets, first = np.unique(ids[order], return_index=True)
+
+                step_lr = lr * (1 - step / n_steps)
+                self.weight[buckets] -= step_lr * np.add.reduceat(values[order], first, axis=0)
+                self.bias -= step_lr * grad.sum(axis=0)
+                step += 1
+
+        return self
+
+    def save(self, path, labels=None):
+        np.savez(path, weight=self.weight, bias=self.bias, ngram_range=np.array(self.ngram_range),
+                 labels=np.array(labels if labels is not None else [], dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        '''Load classifier saved by save(), return (classifier, labels).'''
+
+        data = np.load(path)
+        model = cls(data['weight'].shape[1], data['weight'].shape[0], tuple(data['ngram_range'].tolist()))
+        model.weight, model.bias = data['weight'], data['bias']
+
+        return model, data['labels'].tolist()
+
+@torch.no_grad()
+def rnn_proba(model, names, vocab, packed=PACKED, seq_length=SEQ_LENGTH, temperature=1.0):
+    # class probabilities of the RNN, softened by temperature for distillation
+    device = next(model.parameters()).device
+    feature, lengths = encode_batch(names, vocab, seq_length, packed)
+    return torch.softmax(model(feature.to(device), lengths).float() / temperature, dim=1).cpu().numpy()
+
+class Cascade:
+    '''Answer with the fast n-gram classifier when it is confident and fall
+    back to the RNN otherwise. predict_batch() has the same output as
+    predict.predict_batch, so both can be used by inference.predict_file.
+    -------------------------
+    Parameters:
+    fast        : Trained fast classifier (NgramClassifier).
+    model       : Trained RNN in eval mode (NameRNN, NameLSTM or NameGRU).
+    vocab       : Map char to int (Vocab).
+    labels      : Class names in output order (list of str).
+    threshold   : Fast model probability needed to skip the RNN (float).
+    k           : Number of most probable labels per name (int).
+    packed      : RNN was trained on packed sequences (bool).
+    '''
+
+    def __init__(self, fast, model, vocab, labels, threshold=.9, k=1, packed=PACKED):
+        self.fast = fast
+        self.model = model
+        self.vocab = vocab
+        self.labels = labels
+        self.threshold = threshold
+        self.k = k
+        self.packed = packed
+
+        # names served by each path
+        self.fast_count = 0
+        self.total = 0
+
+    def predict_proba(self, names):
+        '''Class probabilities of names and mask of names served by the fast model.'''
+
+        prob = self.fast.predict_proba(names)
+        confident = prob.max(axis=1) >= self.threshold
+
+        # only uncertain names go through the RNN, in one forward pass
+        uncertain = np.flatnonzero(~confident)
+        if len(uncertain):
+            prob[uncertain] = rnn_proba(self.model, [names[i] for i in uncertain], self.vocab, self.packed)
+
+        self.fast_count += int(confident.sum())
+        self.total += len(names)
+
+        return prob, confident
+
+    def predict_batch(self, names):
+        prob, _ = self.predict_proba(names)
+
+        # most probable first
+        top_id = np.argsort(-prob, axis=1)[:, :self.k]
+        return [[self.labels[i] for i in row] for row in top_id], np.take_along_axis(prob, top_id, axis=1)
+
+    def stats(self):
+        return {'fast': self.fast_count, 'total': self.total,
+                'fast_fraction': self.fast_count / self.total if self.total else None}
+
+def decode(codes, offsets, vocab):
+    # compiled codes back to names
+    chars = [''] + vocab.chars
+    return [''.join(chars[c] for c in codes[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+
+def timed(fn, chunks):
+    # run fn on every chunk, return concatenated results and seconds per chunk
+    results, seconds = [], []
+    for chunk in chunks:
+        start = time.perf_counter()
+        results.append(fn(chunk))
+        seconds.append(time.perf_counter() - start)
+
+    return results, np.array(seconds)
+
+def benchmark(fast, model, vocab, names, targets, thresholds, chunk_size=1024, packed=PACKED):
+    '''Accuracy, latency and fast path share of the RNN alone, the fast
+    model alone and the cascade at every threshold, on names in chunks.'''
+
+    chunks = [names[i:i + chunk_size] for i in range(0, len(names), chunk_size)]
+
+    def report(prob, seconds, fast_fraction):
+        predicted = np.concatenate(prob).argmax(axis=1)
+        return {
+            'accuracy': float((predicted == targets).mean()),
+            'agreement_with_rnn': float((predicted == rnn_predicted).mean()),
+            'fast_fraction': fast_fraction,
+            'chunk_p50_ms': float(np.percentile(seconds, 50) * 1000),
+            'names_per_sec': len(names) / seconds.sum()
+        }
+
+    # warm up both models
+    rnn_proba(model, chunks[0], vocab, packed)
+    fast.predict_proba(chunks[0])
+
+    result = {}
+    prob, seconds = timed(lambda c: rnn_proba(model, c, vocab, packed), chunks)
+    rnn_predicted = np.concatenate(prob).argmax(axis=1)
+    result['rnn'] = report(prob, seconds, 0.)
+
+    prob, seconds = timed(fast.predict_proba, chunks)
+    result['fast'] = report(prob, seconds, 1.)
+
+    for threshold in thresholds:
+        cascade = Cascade(fast, model, vocab, None, threshold, packed=packed)
+        prob, seconds = timed(lambda c: cascade.predict_proba(c)[0], chunks)
+        result[f'cascade@{threshold}'] = report(prob, seconds, cascade.stats()['fast_fraction'])
+
+    return result
+
+if __name__ == '__main__':
+    from vocab import load_vocab
+    from dataloader import compile_data
+    from network import NameRNN, NameLSTM, NameGRU
+
+    NETWORKS = {'RNN': NameRNN, 'LSTM': NameLSTM, 'GRU': NameGRU}
+
+    parser = argparse.ArgumentParser(description='Train fast n-gram classifier and benchmark the cascade against the RNN.')
+    parser.add_argument('--model', choices=list(NETWORKS), default='RNN')
+    parser.add_argument('--checkpoint', help='Trained RNN state_dict, default to MODEL_PATH of the model.')
+    parser.add_argument('--seed', type=int, help='Seed of the RNN training run, default to the seed of its latest checkpoint.')
+    parser.add_argument('--distill', action='store_true', help='Train on RNN probabilities instead of corpus labels.')
+    parser.add_argument('--temperature', type=float, default=2.0, help='Softens RNN probabilities when distilling.')
+    parser.add_argument('--buckets', type=int, default=2**17, help='Hash buckets of n-grams.')
+    parser.add_argument('--ngram', type=int, nargs=2, default=(1, 4), help='Smallest and largest n-gram length.')
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--lr', type=float, default=20.)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[.5, .7, .8, .9, .95])
+    parser.add_argument('--chunk-size', type=int, default=1024, help='Names per batch in the benchmark.')
+    parser.add_argument('--threads', type=int, help='Torch threads, fix it to compare runs.')
+    parser.add_argument('--out', default='./models/cascade.json')
+    args = parser.parse_args()
+
+    # test set is only held out with the seed of the RNN training run
+    from checkpoint import training_seed
+    seed = args.seed if args.seed is not None else training_seed(CHECKPOINT_DIR.format(args.model))
+    if seed is None:
+        parser.error('Training seed unknown, pass --seed.')
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    # same shuffle and split as dataloader.load with the training seed
+    vocab = load_vocab(VOCAB_PATH)
+    dataset = compile_data(DATA_PATH, vocab)
+    labels = dataset['label_names']
+    names = decode(dataset['codes'], dataset['offsets'], vocab)
+    np.random.seed(seed)
+    index = np.random.permutation(len(names))
+    train_id = int(len(index) * .8)
+    test_id = train_id + int((len(index) - train_id) * .5)
+    train_index, test_index = index[:train_id], index[test_id:]
+
+    model = NETWORKS[args.model](len(vocab), len(labels), HID_SIZE, EMB_SIZE)
+    model.load_state_dict(torch.load(args.checkpoint or MODEL_PATH.format(args.model), map_location='cpu'))
+    model.eval()
+
+    # train fast model on corpus labels or RNN probabilities
+    train_names = [names[i] for i in train_index]
+    if args.distill:
+        targets = np.concatenate([rnn_proba(model, train_names[i:i + 4096], vocab, temperature=args.temperature)
+                                  for i in range(0, len(train_names), 4096)])
+    else:
+        targets = np.asarray(dataset['labels'][train_index])
+
+    start = time.time()
+    fast = NgramClassifier(len(labels), args.buckets, args.ngram).fit(train_names, targets, args.epochs, args.lr)
+    print(f'Trained fast model in {time.time() - start:.1f}s')
+    fast.save(NGRAM_PATH, labels)
+
+    result = benchmark(fast, model, vocab, [names[i] for i in test_index], np.asarray(dataset['labels'][test_index]),
+                       args.thresholds, args.chunk_size)
+
+    for name, r in result.items():
+        print(f"{name:<16} acc {r['accuracy']:.4f} | agree {r['agreement_with_rnn']:.4f} | fast {r['fast_fraction']:>6.1%} | "
+              f"p50 {r['chunk_p50_ms']:>8.2f} ms/chunk | {r['names_per_sec']:>10.0f} names/s")
+
+    with open(args.out, 'w') as w:
+        json.dump({'model': args.model, 'seed': seed, 'distill': args.distill, 'chunk_size': args.chunk_size,
+                   'torch_threads': torch.get_num_threads(), 'results': result}, w, indent=2)
+    print(f'Results written to {args.out}')
@@ -12,5 +12,16 @@ TEST_SIZE = .2
 VAL_SIZE = .5
 GRAD_CLIP = 5
 MODEL_PATH = './models/name_rnn{}.pt'
+VOCAB_PATH = './models/vocab.json'
+COMPILED_PATH = './models/cache/names.bin'
+NGRAM_PATH = './models/ngram.npz'
+QUANT_MODEL_PATH = './models/name_rnn{}.int8.pt'
+CHECKPOINT_DIR = './models/checkpoints/{}'
+KEEP_LAST = 3     # Latest epoch checkpoints to keep
 HID_SIZE = 128
 EMB_SIZE = 64
+SEQ_LENGTH = 20   # Padded name length at inference, longest training name
+PACKED = False    # Right padded, length bucketed batches as packed sequences, skips <PAD> steps
+BF16 = False      # bfloat16 autocast for forward pass and loss, weights stay fp32
+METRICS_PATH = './models/metrics.jsonl'    # Training throughput log, None to disable
+PROFILE_STEPS = None    # Steps (start, end) traced by torch.profiler, e.g. (10, 20)
@@ -1,16 +1,19 @@
 import numpy as np
 import os
+import json
 import random
-from torch.utils.data import TensorDataset, DataLoader
+import hashlib
+from torch.utils.data import TensorDataset, DataLoader, Sampler
 import torch
-from constant import BATCH_SIZE
+from vocab import Vocab, load_vocab
+from constant import BATCH_SIZE, VOCAB_PATH, COMPILED_PATH
 import pickle
 
 def load_data(path):
     names, labels = [], []
     all_labels = []
 
-    for f in os.listdir(path):
+    for f in sorted(os.listdir(path)):
         label = f[:-4]
         all_labels.append(label)
 
@@ -35,29 +38,145 @@ def load_data(path):
     return names, labels, all_labels
 
 def build_vocab(names):
-    # get all possible chars
-    chars = tuple(set(''.join(names)))
-    
-    # map int to char
+    # get all possible chars, sorted so indices are the same on every run
     # start vocab index from 1, bcs we'll put <PAD> char in index 0
-    int2char = dict(enumerate(chars, 1))
-    int2char[0] = '<PAD>'
-
-    # map back char to int
-    char2int = {v: k for k, v in int2char.items()}
+    vocab = Vocab.build(names)
 
     # save vocab to disk
-    pickle.dump(char2int, open('./models/vocab.pkl', 'wb'))
+    vocab.save(VOCAB_PATH)
 
-    return char2int
+    return vocab
 
 def encode_words(names, vocab):
     return [[vocab[ch] for ch in name] for name in names]
 
 def encode_labels(labels, labeldict):
-    return np.array([labeldict.index(x) for x in labels])
+    # label to index once, instead of searching labeldict for every sample
+    index = {label: i for i, label in enumerate(labeldict)}
+    return np.array([index[x] for x in labels])
+
+# compiled dataset file layout:
+# magic (8 bytes) | header size (uint64) | json header | arrays, each aligned to ALIGN bytes
+MAGIC = b'NAMEDS\x00\x01'
+ALIGN = 64
+
+def source_hash(path):
+    # hash of every language file name and content, in listing order
+    key = hashlib.sha1()
+    for f in sorted(os.listdir(path)):
+        key.update(f.encode('utf-8') + b'\x00')
+        with open(os.path.join(path, f), 'rb') as r:
+            key.update(hashlib.sha1(r.read()).digest())
+
+    return key.hexdigest()
+
+def read_compiled(cache_path):
+    '''Open compiled dataset, return header and memory-mapped arrays.'''
+
+    with open(cache_path, 'rb') as r:
+        if r.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{cache_path} is not a compiled dataset')
+        size = int(np.frombuffer(r.read(8), dtype='<u8')[0])
+        header = json.loads(r.read(size).decode('utf-8'))
+
+    arrays = {name: np.memmap(cache_path, dtype=a['dtype'], mode='r', offset=a['offset'], shape=tuple(a['shape']))
+              for name, a in header['arrays'].items()}
+
+    return header, arrays
+
+def write_compiled(cache_path, header, arrays):
+    # place arrays at aligned offsets after the header
+    def align(n):
+        return (n + ALIGN - 1) // ALIGN * ALIGN
+
+    # header size depends on the offsets written in it, so reserve room for them first
+    specs = {name: {'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': 0} for name, a in arrays.items()}
+    size = len(json.dumps({**header, 'arrays': specs}).encode('utf-8')) + 20 * len(arrays)
+    offset = align(len(MAGIC) + 8 + size)
+    for name, a in arrays.items():
+        specs[name]['offset'] = offset
+        offset = align(offset + a.nbytes)
+
+    data = json.dumps({**header, 'arrays': specs}).encode('utf-8').ljust(size)
+
+    # write next to the target, then swap, so readers never see a partial file
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    tmp = cache_path + '.tmp'
+    with open(tmp, 'wb') as w:
+        w.write(MAGIC + np.array([size], dtype='<u8').tobytes() + data)
+        for name, a in arrays.items():
+            w.seek(specs[name]['offset'])
+            w.write(np.ascontiguousarray(a).tobytes())
+    os.replace(tmp, cache_path)
+
+def compile_data(path, vocab=None, cache_path=COMPILED_PATH):
+    '''Encode all language files once into a single memory-mappable file.
+    The file holds flat codes of all names with their offsets, int labels,
+    label names, vocab and a hash of the source files, and is rebuilt only
+    when a source file or the given vocab changes.
+    -------------------------
+    Parameters:
+    path        : Directory of language files, one name per line (str).
+    vocab       : Vocabulary to encode with, built from names if None (Vocab).
+    cache_path  : Compiled dataset file (str).
+
+    Returns dict of codes, offsets and labels arrays (name i is
+    codes[offsets[i]:offsets[i+1]] with label labels[i]), label names and vocab.
+    '''
+
+    digest = source_hash(path)
+
+    # use compiled file if it matches sources and vocab
+    try:
+        header, arrays = read_compiled(cache_path)
+        if header['source_hash'] == digest and (vocab is None or header['vocab'] == vocab.chars):
+            return {**arrays, 'label_names': header['labels'], 'vocab': vocab or Vocab(header['vocab'])}
+    except (FileNotFoundError, ValueError):
+        pass
+
+    # one label per file, read each file at once
+    label_names, texts = [], []
+    for f in sorted(os.listdir(path)):
+        label_names.append(f[:-4])
+        with open(os.path.join(path, f), encoding='utf-8') as r:
+            texts.append(r.read().strip().split('\n'))
+
+    if vocab is None:
+        vocab = Vocab(sorted(set().union(*(set(''.join(names)) for names in texts))))
+
+    # encode every file at once, labels repeat per file
+    codes, offsets = vocab.encode([name for names in texts for name in names])
+    labels = np.repeat(np.arange(len(label_names), dtype=np.int32), [len(names) for names in texts])
+
+    write_compiled(cache_path, {'version': 1, 'source_hash': digest, 'vocab': vocab.chars, 'labels': label_names},
+                   {'codes': codes, 'offsets': offsets, 'labels': labels})
+
+    return {'codes': codes, 'offsets': offsets, 'labels': labels, 'label_names': label_names, 'vocab': vocab}
+
+def pad_codes(codes, offsets, seq_length=None, right=False):
+    '''Build padded feature matrix from flat codes and offsets without
+    looping over names, same result as pad_features(encode_words(...)).
+    '''
+
+    lengths = np.diff(offsets)
 
-def pad_features(names, seq_length=None):
+    # if seq_length is None, then select the longest feature as maximum
+    if seq_length == None:
+        seq_length = int(lengths.max(initial=0))
+    lengths = np.minimum(lengths, seq_length)
+
+    # row and position of every kept char
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    position = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    # fill feature template from back, or from front for packed sequences
+    cols = position if right else seq_length - np.repeat(lengths, lengths) + position
+    features = np.zeros((len(lengths), seq_length), dtype=np.int64)
+    features[rows, cols] = codes[np.repeat(offsets[:-1], lengths) + position]
+
+    return features
+
+def pad_features(names, seq_length=None, right=False):
     # if seq_length is None, then select the longest feature as maximum
     if seq_length == None:
         seq_length = max([len(x) for x in names])
@@ -66,9 +185,12 @@ def pad_features(names, seq_length=None):
     # create zeros-like array for feature template
     features = np.zeros((len(names), seq_length), dtype=int)    
 
-    # fill feature template from back
+    # fill feature template from back, or from front for packed sequences
     for i, row in enumerate(names):                           
-        features[i, -len(row):] = np.array(row)[:seq_length]
+        if right:
+            features[i, :min(len(row), seq_length)] = np.array(row)[:seq_length]
+        else:
+            features[i, -len(row):] = np.array(row)[:seq_length]
 
     # make sure total features and total names is equal
     assert len(features) == len(names)
@@ -107,7 +229,52 @@ def split_data(x, y, train_size=.8, test_size=.2, val_set=True, val_size=.5):
 
         return (train_x, train_y), (test_x, test_y), (val_x, val_y)
 
-def make_batch(train_feature, test_feature, valid_feature=None, batch_size=64):
+class BucketBatchSampler(Sampler):
+    '''Yield batches of indices whose names have similar length, so packed
+    batches carry little padding. Batch order is shuffled every epoch, call
+    set_epoch to get a new order.
+    -------------------------
+    Parameters:
+    lengths     : Name length of each sample (1D array).
+    batch_size  : Batch size (int).
+    shuffle     : Shuffle names of equal length and batch order (bool).
+    seed        : Shuffle seed (int).
+    '''
+
+    def __init__(self, lengths, batch_size=64, shuffle=True, seed=None):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+
+        # sort by length, random tie break so buckets differ between epochs
+        if self.shuffle:
+            index = np.lexsort((rng.random(len(self.lengths)), self.lengths))
+        else:
+            index = np.argsort(self.lengths, kind='stable')
+
+        batches = [index[i:i+self.batch_size] for i in range(0, len(index), self.batch_size)]
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+
+        for batch in batches:
+            yield batch.tolist()
+
+def feature_lengths(features):
+    # count chars of each right padded name
+    return (features != 0).sum(axis=1)
+
+def make_batch(train_feature, test_feature, valid_feature=None, batch_size=64, bucket=False):
     '''Generate data batch using PyTorch Dataset and DataLoader.
     -------------------------
     Parameters:
@@ -115,56 +282,59 @@ def make_batch(train_feature, test_feature, valid_feature=None, batch_size=64):
     test_feature    : Test feature (tuple).
     valid_feature   : Validation feature (tuple).
     batch_size      : Batch size. Default to 64 (int).
+    bucket          : Batch names of similar length together and add their
+                      lengths to each batch as (feature, target, lengths),
+                      used for packed training of right padded names (bool).
     '''
 
-    # generate TensorDataset
-    trainset = TensorDataset(
-                            torch.from_numpy(train_feature[0]),
-                            torch.from_numpy(train_feature[1]))
-    testset = TensorDataset(
-                            torch.from_numpy(test_feature[0]),
-                            torch.from_numpy(test_feature[1]))
-    
-    # if validation feature provided
-    if valid_feature != None:
-        validset = TensorDataset(
-                                torch.from_numpy(valid_feature[0]),
-                                torch.from_numpy(valid_feature[1]))
+    def make_loader(feature):
+        if not bucket:
+            dataset = TensorDataset(torch.from_numpy(feature[0]), torch.from_numpy(feature[1]))
+            return DataLoader(dataset, shuffle=True, batch_size=batch_size)
 
-    # generate DataLoader
-    train_loader = DataLoader(trainset, shuffle=True, batch_size=batch_size)
-    test_loader = DataLoader(testset, shuffle=True, batch_size=batch_size)
+        lengths = feature_lengths(feature[0])
+        dataset = TensorDataset(torch.from_numpy(feature[0]), torch.from_numpy(feature[1]), torch.from_numpy(lengths))
+        return DataLoader(dataset, batch_sampler=BucketBatchSampler(lengths, batch_size))
 
-    try:
-        val_loader = DataLoader(validset, shuffle=True, batch_size=batch_size)
-        
-        return train_loader, test_loader, val_loader
+    # generate DataLoader
+    train_loader = make_loader(train_feature)
+    test_loader = make_loader(test_feature)
 
-    except:
-        # validation feature were not provided.
+    # validation feature were not provided.
+    if valid_feature is None:
         return train_loader, test_loader
 
-def load(path):
-    # load dataset
-    names, labels, all_labels = load_data(path)    
+    val_loader = make_loader(valid_feature)
+
+    return train_loader, test_loader, val_loader
+
+def load(path, packed=False, batch_size=BATCH_SIZE):
     try:
         # load vocab
-        vocab = pickle.load(open('./models/vocab.pkl', 'rb'))
+        vocab = load_vocab(VOCAB_PATH)
         print('Use existing vocabulary.')
-    except:
-        # build vocab
-        vocab = build_vocab(names)
-                
-    # encode words
-    enc_words = encode_words(names, vocab)
-    # encode labels
-    enc_labels = encode_labels(labels, all_labels)
-    # pad features
-    padded = pad_features(enc_words)
+    except FileNotFoundError:
+        # build vocab while compiling
+        vocab = None
+
+    # encoded names and labels, compiled once and reused while sources don't change
+    dataset = compile_data(path, vocab)
+    if vocab is None:
+        vocab = dataset['vocab']
+        vocab.save(VOCAB_PATH)
+
+    # save labels to disk
+    all_labels = dataset['label_names']
+    pickle.dump(all_labels, open('./models/labels.pkl', 'wb'))
+
+    # pad features, right padded for packed sequences
+    padded = pad_codes(dataset['codes'], dataset['offsets'], right=packed)
+    # shuffle dataset
+    index = np.random.permutation(len(padded))
     # split data
-    train, test, val = split_data(padded, enc_labels, train_size=.8)
+    train, test, val = split_data(padded[index], dataset['labels'][index].astype(np.int64), train_size=.8)
     # make batch
-    train_loader, test_loader, val_loader = make_batch(train, test, val, batch_size=BATCH_SIZE)
+    train_loader, test_loader, val_loader = make_batch(train, test, val, batch_size=batch_size, bucket=packed)
 
     return (train_loader, test_loader, val_loader), vocab, all_labels
 
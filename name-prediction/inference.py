@@ -1,51 +1,189 @@
+import sys
+import csv
+import json
 import torch
-from dataloader import encode_words, pad_features, load_data
+import numpy as np
 import pickle
-from constant import DEVICE, DATA_PATH, HID_SIZE, EMB_SIZE
+import argparse
+from constant import DEVICE, HID_SIZE, EMB_SIZE, MODEL_PATH, QUANT_MODEL_PATH, VOCAB_PATH, PACKED, NGRAM_PATH
+from vocab import load_vocab
 from network import NameRNN, NameLSTM, NameGRU
 from utils import output_to_label
+from precision import autocast
+from predict import encode_batch, predict_batch
+
+NETWORKS = {'RNN': NameRNN, 'LSTM': NameLSTM, 'GRU': NameGRU}
 
 def load_model(path):
     checkpoint = torch.load(path)
     return checkpoint
 
-def predict(model, input, vocab):
+def predict(model, input, vocab, packed=PACKED):
     print(f'>>> {input}')
 
     with torch.no_grad():     
-        # transform input to vector
-        encoded = encode_words([input], vocab)
-        # add padding with seq_length=20
-        feature = torch.from_numpy(pad_features(encoded, seq_length=20))
+        # transform input to vector, padded with seq_length=20 unless packed
+        feature, lengths = encode_batch([input], vocab, packed=packed)
 
         # move to device
         model = model.to(DEVICE)
         feature = feature.to(DEVICE)
 
         # forward pass
-        out = model(feature)
+        out = model(feature, lengths)
 
     return out
 
+def read_names(file, chunk_size=4096):
+    # yield lists of up to chunk_size names, one name per line, empty lines skipped
+    chunk = []
+    for line in file:
+        name = line.strip()
+        if not name:
+            continue
+
+        chunk.append(name)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+class PredictionWriter:
+    '''Write name, top k labels and probabilities as CSV or JSONL rows.'''
+
+    def __init__(self, file, k=1, format='csv'):
+        self.file = file
+        self.format = format
+
+        if format == 'csv':
+            self.csv = csv.writer(file)
+            self.csv.writerow(['name'] + [col for i in range(1, k + 1) for col in (f'label_{i}', f'prob_{i}')])
+
+    def write(self, names, top_labels, top_probs):
+        if self.format == 'csv':
+            self.csv.writerows([name] + [col for pair in zip(label, prob.astype(np.float64).round(6).tolist()) for col in pair]
+                               for name, label, prob in zip(names, top_labels, top_probs))
+        else:
+            self.file.writelines(json.dumps({'name': name, 'labels': label, 'probs': prob.astype(np.float64).round(6).tolist()},
+                                            ensure_ascii=False) + '\n'
+                                 for name, label, prob in zip(names, top_labels, top_probs))
+
+def predict_file(model, vocab, labels, input, output, k=1, chunk_size=4096, format='csv', predictor=None, before_chunk=None):
+    '''Classify every name of file input (one per line) in chunks of
+    chunk_size names and write predictions to file output, through predictor
+    (cache.CachedPredictor or cascade.Cascade) if given. before_chunk is
+    called before every chunk, e.g. to reload a rewritten checkpoint.
+    Returns number of names written.
+    '''
+
+    writer = PredictionWriter(output, k, format)
+
+    count = 0
+    for names in read_names(input, chunk_size):
+        if before_chunk is not None:
+            before_chunk()
+        if predictor is not None:
+            top_labels, top_probs = predictor.predict_batch(names)
+        else:
+            top_labels, top_probs = predict_batch(model, names, vocab, labels, k)
+        writer.write(names, top_labels, top_probs)
+        count += len(names)
+
+    return count
+
 if __name__ == '__main__':    
 
-    # load vocab and labels
-    print('Load vocab and labels...')    
-    vocab = pickle.load(open('./models/vocab.pkl', 'rb'))
-    labels = pickle.load(open('./models/labels.pkl', 'rb'))    
+    parser = argparse.ArgumentParser(description='Predict name nationality interactively.')
+    parser.add_argument('--int8', action='store_true', help='Load int8 checkpoint written by quantize.py (CPU only).')
+    parser.add_argument('--bundle', help='Load model, vocab and labels from a bundle written by bundle.py.')
+    parser.add_argument('--model', choices=list(NETWORKS), default='RNN')
+    parser.add_argument('--input', help='Names file to classify, one per line, - for stdin. Interactive if not given.')
+    parser.add_argument('--output', help='Predictions file, default to stdout.')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    parser.add_argument('--top-k', type=int, default=1, help='Most probable labels per name.')
+    parser.add_argument('--chunk-size', type=int, default=4096, help='Names per forward pass.')
+    parser.add_argument('--cache-size', type=int, default=0, help='Cache predictions of this many names, 0 to disable. Not with --fast.')
+    parser.add_argument('--fast', nargs='?', const=NGRAM_PATH, help='Answer confident names with the n-gram classifier written by cascade.py.')
+    parser.add_argument('--threshold', type=float, default=.9, help='Fast classifier probability needed to skip the model.')
+    parser.add_argument('--bf16', action='store_true', help='Run model under bfloat16 autocast.')
+    args = parser.parse_args()
+
+    # cascade answers from the n-gram classifier or the model, the cache only sits in front of the model
+    if args.fast and args.cache_size > 0:
+        parser.error('--fast and --cache-size can not be combined.')
+
+    # keep stdout clean for predictions in batch mode
+    log = (lambda *a, **kw: print(*a, file=sys.stderr, **kw)) if args.input else print
+
+    if args.bundle:
+        # bundle carries its own architecture, vocab and labels
+        from bundle import load_bundle
+        path = args.bundle
+    else:
+        # load vocab and labels
+        log('Load vocab and labels...')
+        vocab = load_vocab(VOCAB_PATH)
+        labels = pickle.load(open('./models/labels.pkl', 'rb'))
+        path = QUANT_MODEL_PATH.format(args.model) if args.int8 else MODEL_PATH.format(args.model)
+
+    def load_weights():
+        # model of the checkpoint at path in eval mode on DEVICE, vocab and labels
+        if args.bundle:
+            log('Load model bundle...')
+            model, *vocab_labels = load_bundle(path)
+            return (model.to(DEVICE).eval(), *vocab_labels)
+
+        # define network
+        model = NETWORKS[args.model](len(vocab), len(labels), HID_SIZE, EMB_SIZE)
+
+        # load model
+        log('Load model checkpoint...')
+        if args.int8:
+            from quantize import load_quantized
+            model = load_quantized(model, path)
+        else:
+            model_weights = load_model(path)
+
+            log('Apply checkpoints to model...')
+            model.load_state_dict(model_weights)
+
+        return model.to(DEVICE).eval(), vocab, labels
+
+    model, vocab, labels = load_weights()
+
+    if args.input:
+        # batch mode, stream names in chunks
+        input = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+        output = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
 
-    # load model
-    print('Load model checkpoint...')
-    path = './models/name_rnnRNN.pt'
-    model_weights = load_model(path)    
+        predictor, before_chunk = None, None
+        if args.fast:
+            from cascade import Cascade, NgramClassifier
+            fast, fast_labels = NgramClassifier.load(args.fast)
+            # fast and RNN probabilities are mixed by class index, so classes must line up
+            if list(fast_labels) != list(labels):
+                raise ValueError(f'Labels of {args.fast} differ from the model labels, retrain it with cascade.py.')
+            predictor = Cascade(fast, model, vocab, labels, args.threshold, args.top_k)
+        elif args.cache_size > 0:
+            from cache import CachedPredictor, checkpoint_version
+            predictor = CachedPredictor(model, vocab, labels, args.top_k, args.cache_size, version=checkpoint_version(path))
 
-    # define network
-    print('Apply checkpoints to model...')
-    model = NameRNN(len(vocab), len(labels), HID_SIZE, EMB_SIZE)    
-    model.load_state_dict(model_weights)
+            def before_chunk():
+                # pick up a checkpoint rewritten during a long run, cached results of the old one are dropped
+                version = checkpoint_version(path)
+                if version != predictor.version:
+                    predictor.reload(load_weights()[0], version)
 
-    # put model to eval mode
-    model.eval()
+        with autocast(args.bf16):
+            count = predict_file(model, vocab, labels, input, output, args.top_k, args.chunk_size, args.format,
+                                 predictor, before_chunk)
+        output.flush()
+        log(f'Classified {count} names.')
+        if predictor is not None:
+            log(f'{type(predictor).__name__}: {predictor.stats()}')
+        sys.exit()
 
     print('\n')
 
@@ -55,6 +193,7 @@ if __name__ == '__main__':
         if name == 'quit':
             break
 
-        out = predict(model, name, vocab)        
-        _, predicted = output_to_label(labels, out)
+        with autocast(args.bf16):
+            out = predict(model, name, vocab)
+        _, predicted = output_to_label(labels, out[0])
         print(f'Predicted Country: {predicted}', end='\n\n')
\ No newline at end of file
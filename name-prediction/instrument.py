@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import torch
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+def peak_rss_mb():
+    # peak resident memory of this process, ru_maxrss is in KB on Linux
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class TrainingMonitor:
+    '''Record where training time goes and write it as JSONL.
+    Every epoch writes one record with time spent per phase (data, forward,
+    backward, optimizer, validation), samples/sec, tokens/sec and peak RSS.
+    Per step records are written too if log_steps.
+    -------------------------
+    Parameters:
+    path            : JSONL output file (str).
+    log_steps       : Also write one record per training step (bool).
+    profile_steps   : Wrap global steps [start, end) in torch.profiler and
+                      export a chrome trace, disabled if None (tuple of int).
+    trace_path      : Chrome trace output file (str).
+    sync            : Synchronize cuda around every phase and time it with
+                      the host clock. By default phases on cuda are timed with
+                      cuda events read at epoch end, so training doesn't wait
+                      on the device every step. The profiler window always syncs (bool).
+    '''
+
+    def __init__(self, path, log_steps=False, profile_steps=None, trace_path='./models/trace.json', sync=False):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path, 'a')
+        self.log_steps = log_steps
+        self.profile_steps = profile_steps
+        self.sync = sync
+        self.cuda = torch.cuda.is_available()
+        self.global_step = 0
+
+        # cuda events of the current step, and (step record, events) waiting to be read
+        self._step_events = []
+        self._pending = []
+
+        self.start_epoch()
+
+        self.profiler = None
+        if profile_steps is not None:
+            start, end = profile_steps
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+            self.profiler = torch.profiler.profile(
+                activities=activities,
+                schedule=torch.profiler.schedule(wait=max(start - 1, 0), warmup=min(start, 1), active=end - start, repeat=1),
+                on_trace_ready=lambda prof: prof.export_chrome_trace(trace_path),
+                record_shapes=True)
+            self.profiler.start()
+
+    def start_epoch(self):
+        '''Reset counters and restart epoch clock, so time outside
+        the epoch loop isn't counted.'''
+
+        self.phases = {}
+        self._step_phases = {}
+        self.samples = 0
+        self.tokens = 0
+        self.steps = 0
+        self.epoch_start = time.perf_counter()
+
+    def _add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+        self._step_phases[name] = self._step_phases.get(name, 0) + seconds
+
+    def _host_clock(self):
+        # cuda kernels run async, the host clock needs a sync before it is read
+        if not self.cuda or self.sync:
+            return True
+        return self.profiler is not None and self.profile_steps[0] <= self.global_step < self.profile_steps[1]
+
+    @contextmanager
+    def phase(self, name):
+        '''Time block of code as phase name.'''
+
+        if self._host_clock():
+            if self.cuda:
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                if self.cuda:
+                    torch.cuda.synchronize()
+                self._add(name, time.perf_counter() - start)
+            return
+
+        # events are recorded in the cuda stream, elapsed time is read later
+        start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+        start.record()
+        try:
+            yield
+        finally:
+            end.record()
+            self._step_events.append((name, start, end))
+
+    def _resolve(self):
+        # wait for the device once, then add event times to phases and write deferred step records
+        if self._step_events:
+            self._pending.append((None, self._step_events))
+            self._step_events = []
+        if self.cuda:
+            torch.cuda.synchronize()
+
+        for record, events in self._pending:
+            for name, start, end in events:
+                seconds = start.elapsed_time(end) / 1000
+                self.phases[name] = self.phases.get(name, 0) + seconds
+                if record is not None:
+                    record[name] = record.get(name, 0) + seconds
+            if record is not None:
+                self._write(record)
+        self._pending = []
+
+    def timed(self, loader, name='data'):
+        '''Iterate loader, timing each batch fetch as phase name.'''
+
+        batches = iter(loader)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(batches)
+            except StopIteration:
+                return
+            self._add(name, time.perf_counter() - start)
+
+            yield batch
+
+    def step(self, epoch, samples, tokens):
+        '''Mark the end of one training step.'''
+
+        self.samples += samples
+        self.tokens += tokens
+        self.steps += 1
+
+        record = None
+        if self.log_steps:
+            record = {'type': 'step', 'epoch': epoch, 'step': self.global_step,
+                      'samples': samples, 'tokens': tokens, **self._step_phases}
+
+        # step with cuda event times is written once they are read at epoch end
+        if self._step_events or self._pending:
+            self._pending.append((record, self._step_events))
+            self._step_events = []
+        elif record is not None:
+            self._write(record)
+
+        self._step_phases = {}
+        self.global_step += 1
+
+        if self.profiler is not None:
+            self.profiler.step()
+
+    def epoch_end(self, epoch, **metrics):
+        '''Write epoch summary and start counting the next epoch.'''
+
+        self._resolve()
+        seconds = time.perf_counter() - self.epoch_start
+        train_seconds = seconds - self.phases.get('validation', 0)
+
+        self._write({
+            'type': 'epoch',
+            'epoch': epoch,
+            'seconds': seconds,
+            'steps': self.steps,
+            'phases': self.phases,
+            'samples_per_sec': self.samples / train_seconds if train_seconds else None,
+            'tokens_per_sec': self.tokens / train_seconds if train_seconds else None,
+            'peak_rss_mb': peak_rss_mb(),
+            **metrics
+        })
+
+        self.start_epoch()
+
+    def close(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
+        self.file.close()
+
+    def _write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+class NullMonitor:
+    '''Monitor with the same interface that records nothing.'''
+
+    def start_epoch(self):
+        pass
+
+    def phase(self, name):
+        return nullcontext()
+
+    def timed(self, loader, name='data'):
+        return loader
+
+    def step(self, epoch, samples, tokens):
+        pass
+
+    def epoch_end(self, epoch, **metrics):
+        pass
+
+    def close(self):
+        pass
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Summarize training throughput log.')
+    parser.add_argument('path', nargs='?', default='./models/metrics.jsonl')
+    args = parser.parse_args()
+
+    # print time share of every phase per epoch
+    for line in open(args.path):
+        record = json.loads(line)
+        if record['type'] != 'epoch':
+            continue
+
+        share = ' | '.join(f'{k}: {v / record["seconds"]:.0%}' for k, v in record['phases'].items())
+        print(f"Epoch {record['epoch']+1} | {record['seconds']:.2f}s | {record['samples_per_sec']:.0f} samples/s | "
+              f"{record['tokens_per_sec']:.0f} tokens/s | {share}")
@@ -1,49 +1,94 @@
 from network import NameRNN, NameGRU, NameLSTM
 from dataloader import load
-from train import train, test, plot_loss
+from train import train, test, plot_loss, plot_confusion
+from instrument import TrainingMonitor
+from checkpoint import CheckpointManager, load_checkpoint, latest_checkpoint
 import time
+import random
+import argparse
+import numpy as np
 from InquirerPy import prompt
-from constant import DATA_PATH, HID_SIZE, EMB_SIZE, EPOCH, LR, PRINT_EVERY, GRAD_CLIP, MODEL_PATH
+from constant import DATA_PATH, HID_SIZE, EMB_SIZE, EPOCH, LR, PRINT_EVERY, GRAD_CLIP, MODEL_PATH, PACKED, METRICS_PATH, PROFILE_STEPS, CHECKPOINT_DIR, KEEP_LAST
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train name nationality classifier.')
+    parser.add_argument('--resume', nargs='?', const='latest',
+                        help='Continue from checkpoint file, or from the latest checkpoint of the chosen model if no file given.')
+    args = parser.parse_args()
+
+    resume = None
+    if args.resume and args.resume != 'latest':
+        # checkpoint knows its own model type
+        resume = load_checkpoint(args.resume)
+        model_name = resume['meta']['model']
+
+    else:
+        # prompt model selection
+        questions = [
+            {
+                'type': 'list',
+                'message': 'Choose model options',
+                'choices': ['RNN', 'LSTM', 'GRU'],
+                'name': 'model'
+            }
+        ]
+        model_opt = prompt(questions)
+        model_name = model_opt['model']
+
+        if args.resume:
+            path = latest_checkpoint(CHECKPOINT_DIR.format(model_name))
+            if path is None:
+                raise FileNotFoundError(f'No checkpoint found in {CHECKPOINT_DIR.format(model_name)}')
+            resume = load_checkpoint(path)
+
+    if resume is not None:
+        print(f"Resume {model_name} from Epoch-{resume['epoch']+1}...")
+
+    # same seed gives the same shuffle and split when resuming
+    seed = resume['meta']['seed'] if resume is not None else random.randrange(2**32)
+    random.seed(seed)
+    np.random.seed(seed)
+
     # load data and generate loader
     print('Load and generate DataLoader...')
-    loader, vocab, labels = load(DATA_PATH)
-
-    # prompt model selection
-    questions = [
-        {
-            'type': 'list',
-            'message': 'Choose model options',
-            'choices': ['RNN', 'LSTM', 'GRU'],
-            'name': 'model'
-        }
-    ]
-    model_opt = prompt(questions)    
+    loader, vocab, labels = load(DATA_PATH, packed=PACKED)
 
     # init model
     print('Initializing model...')    
     # model init
-    if model_opt['model'] == 'RNN':
+    if model_name == 'RNN':
         network = NameRNN(len(vocab), len(labels), HID_SIZE, EMB_SIZE)
-    elif model_opt['model'] == 'LSTM':
+    elif model_name == 'LSTM':
         network = NameLSTM(len(vocab), len(labels), HID_SIZE, EMB_SIZE)
-    elif model_opt['model'] == 'GRU':
+    elif model_name == 'GRU':
         network = NameGRU(len(vocab), len(labels), HID_SIZE, EMB_SIZE)
-    save_path = MODEL_PATH.format(model_opt['model'])
+    save_path = MODEL_PATH.format(model_name)
 
     # unpack loader
     train_loader, test_loader, val_loader = loader
 
+    # record training throughput
+    monitor = TrainingMonitor(METRICS_PATH, profile_steps=PROFILE_STEPS) if METRICS_PATH else None
+
+    # write full training state every epoch in background
+    checkpoint = CheckpointManager(CHECKPOINT_DIR.format(model_name), KEEP_LAST, save_path,
+                                   meta={'model': model_name, 'seed': seed})
+
     # train
     print('Training start...')
     start = time.time()
-    model, history = train(network, train_loader, val_loader, EPOCH, LR, PRINT_EVERY, GRAD_CLIP, save_path)
+    model, history = train(network, train_loader, val_loader, EPOCH, LR, PRINT_EVERY, GRAD_CLIP, save_path,
+                           monitor=monitor, checkpoint=checkpoint, resume=resume)
     print(f'Training done. Time elapsed {time.time() - start:.2f} second.')
+
+    checkpoint.close()
+    if monitor is not None:
+        monitor.close()
     
     # plot loss
     plot_loss(history)
 
     # inference on test set
     print('Inference on Test set.')
-    test(model, test_loader)
+    _, _, confusion = test(model, test_loader, return_confusion=True)
+    plot_confusion(confusion, labels)
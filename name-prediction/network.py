@@ -1,4 +1,5 @@
 from torch import nn
+from torch.nn.utils.rnn import pack_padded_sequence
 
 class NameRNN(nn.Module):
     def __init__(self, vocab_size, out_size, hid_size=64, emb_size=32):
@@ -14,21 +15,29 @@ class NameRNN(nn.Module):
         # Linear layer for output
         self.output = nn.Linear(hid_size, out_size)
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         # here we only take input without previous hidden_state
         # bcs we let PyTorch define initial hidden_state for us
 
         # map input to vector
         x = self.embedding(x)
 
-        # compute current hidden state
-        # this layer returns output and hidden_state vector
-        # but we'll take only the output vector
-        o, _ = self.rnn(x)  
+        # with lengths of the right padded input, <PAD> steps are skipped
+        # and the last hidden state is the one of the last real char
+        if lengths is not None:
+            x = pack_padded_sequence(x, lengths.cpu().clamp(min=1), batch_first=True, enforce_sorted=False)
+            _, h = self.rnn(x)
+            o = h[-1]       # (batch_size, hid_size)
 
-        # get last sequence output, bcs in this task we usually
-        # want to take output vector from the very last sequence
-        o = o[:, -1, :]     # (batch_size, seq_length, out_size)
+        else:
+            # compute current hidden state
+            # this layer returns output and hidden_state vector
+            # but we'll take only the output vector
+            o, _ = self.rnn(x)
+
+            # get last sequence output, bcs in this task we usually
+            # want to take output vector from the very last sequence
+            o = o[:, -1, :]     # (batch_size, seq_length, out_size)
 
         # feed output to linear layer
         out = self.output(o)
@@ -49,15 +58,22 @@ class NameLSTM(nn.Module):
         # linear layer
         self.output = nn.Linear(hid_size, out_size)
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         # map input to vector
         x = self.embedding(x)
 
-        # compute current hidden state
-        o, _ = self.lstm(x)
+        # skip <PAD> steps when lengths of the right padded input are given
+        if lengths is not None:
+            x = pack_padded_sequence(x, lengths.cpu().clamp(min=1), batch_first=True, enforce_sorted=False)
+            _, (h, _) = self.lstm(x)
+            o = h[-1]
+
+        else:
+            # compute current hidden state
+            o, _ = self.lstm(x)
 
-        # get last sequence output
-        o = o[:, -1, :]
+            # get last sequence output
+            o = o[:, -1, :]
 
         # feed output to linear layer
         out = self.output(o)
@@ -78,17 +94,24 @@ class NameGRU(nn.Module):
         # linear layer
         self.output = nn.Linear(hid_size, out_size)
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         # map input to vector
         x = self.embedding(x)
 
-        # compute current hidden state
-        o, _ = self.gru(x)
+        # skip <PAD> steps when lengths of the right padded input are given
+        if lengths is not None:
+            x = pack_padded_sequence(x, lengths.cpu().clamp(min=1), batch_first=True, enforce_sorted=False)
+            _, h = self.gru(x)
+            o = h[-1]
+
+        else:
+            # compute current hidden state
+            o, _ = self.gru(x)
 
-        # get last sequence output
-        o = o[:, -1, :]
+            # get last sequence output
+            o = o[:, -1, :]
 
         # feed output to linear layer
         out = self.output(o)
 
-        return o
\ No newline at end of file
+        return out
\ No newline at end of file
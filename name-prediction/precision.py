@@ -0,0 +1,93 @@
+'''bfloat16 mixed precision for training and inference.
+
+Under autocast, matmuls of the forward pass and loss run in bfloat16 while
+weights, gradients and optimizer state stay fp32, so no loss scaling is needed.
+It only pays off on CPUs with native bf16 (AVX512-BF16 or AMX) and its gain
+depends on the cell, run the comparison before turning BF16 on:
+
+    python precision.py --model GRU --epochs 3
+'''
+import json
+import time
+import argparse
+import numpy as np
+import torch
+from constant import DEVICE
+
+def autocast(enabled=True, device=DEVICE):
+    '''bfloat16 autocast context for forward pass and loss, no-op if not enabled.'''
+
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=enabled)
+
+def bf16_supported(device=DEVICE):
+    # autocast works anywhere, but is only fast with native bf16 instructions
+    if device.type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+
+if __name__ == '__main__':
+    from constant import DATA_PATH, HID_SIZE, EMB_SIZE, LR, GRAD_CLIP, PACKED
+    from dataloader import load
+    from train import train, test
+    from predict import predict_batch
+    from network import NameRNN, NameLSTM, NameGRU
+
+    NETWORKS = {'RNN': NameRNN, 'LSTM': NameLSTM, 'GRU': NameGRU}
+
+    parser = argparse.ArgumentParser(description='Compare fp32 and bf16 autocast training and inference.')
+    parser.add_argument('--model', choices=list(NETWORKS), default='GRU')
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threads', type=int, help='Torch threads, fix it to compare runs.')
+    parser.add_argument('--out', default='./models/precision.json')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if not bf16_supported():
+        print('[WARNING] No native bf16 support, bf16 is emulated and likely slower.')
+
+    # same shuffle and split for both runs
+    np.random.seed(args.seed)
+    (train_loader, test_loader, val_loader), vocab, labels = load(DATA_PATH, packed=PACKED)
+    names = ['Satoshi', 'Nguyen', 'Abercrombie', 'Schmidt'] * 256
+
+    result = {}
+    for name, bf16 in (('fp32', False), ('bf16', True)):
+        # same initial weights and batches for both runs
+        torch.manual_seed(args.seed)
+        model = NETWORKS[args.model](len(vocab), len(labels), HID_SIZE, EMB_SIZE)
+
+        start = time.perf_counter()
+        model, history = train(model, train_loader, val_loader, args.epochs, LR, args.epochs, GRAD_CLIP,
+                               f'./models/precision_{name}.pt', bf16=bf16)
+        train_seconds = time.perf_counter() - start
+
+        # batch inference latency
+        model.eval()
+        with autocast(bf16):
+            predict_batch(model, names, vocab, labels)
+            start = time.perf_counter()
+            for _ in range(10):
+                predict_batch(model, names, vocab, labels)
+            predict_ms = (time.perf_counter() - start) * 100
+
+        test_acc, test_loss = test(model, test_loader, bf16=bf16)
+        result[name] = {
+            'train_sec_per_epoch': train_seconds / history['epochs'],
+            'train_loss': history['train_loss'][-1],
+            'val_loss': history['val_loss'][-1],
+            'test_acc': test_acc,
+            'test_loss': test_loss,
+            f'predict_{len(names)}_ms': predict_ms
+        }
+
+    result['speedup'] = {
+        'train': result['fp32']['train_sec_per_epoch'] / result['bf16']['train_sec_per_epoch'],
+        'predict': result['fp32'][f'predict_{len(names)}_ms'] / result['bf16'][f'predict_{len(names)}_ms']
+    }
+    result['meta'] = {'model': args.model, 'epochs': args.epochs, 'packed': PACKED, 'threads': torch.get_num_threads(),
+                      'cpu_capability': torch.backends.cpu.get_cpu_capability(), 'bf16_supported': bf16_supported()}
+
+    print(json.dumps(result, indent=2))
+    json.dump(result, open(args.out, 'w'), indent=2)
@@ -0,0 +1,64 @@
+import torch
+import numpy as np
+from constant import SEQ_LENGTH, PACKED
+
+def encode_batch(names, vocab, seq_length=SEQ_LENGTH, packed=False):
+    '''Encode and left pad names to (len(names), seq_length) like training
+    features, without looping over names. Chars not in vocab are dropped and
+    names longer than seq_length keep their first seq_length chars.
+    If packed, names are right padded to the longest name instead and
+    returned with their lengths, else lengths is None. Names left empty
+    are all <PAD>, like they are in the unpacked features.
+    '''
+
+    try:
+        codes, offsets = vocab.encode(names)
+    except KeyError:
+        # unknown chars are rare, only then filter name by name
+        names = [''.join(ch for ch in name if ch in vocab) for name in names]
+        codes, offsets = vocab.encode(names)
+
+    lengths = np.diff(offsets)
+    if packed:
+        # at least one <PAD> column, a chunk of only empty names (or only
+        # unknown chars) would be zero width and can't be packed
+        seq_length = max(int(lengths.max(initial=0)), 1)
+    lengths = np.minimum(lengths, seq_length)
+
+    # position of every kept char inside its name
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    position = np.arange(lengths.sum()) - starts
+
+    # fill feature template from back like pad_features, or from front if packed
+    rows = np.repeat(np.arange(len(names)), lengths)
+    cols = position if packed else seq_length - np.repeat(lengths, lengths) + position
+    features = np.zeros((len(names), seq_length), dtype=np.int64)
+    features[rows, cols] = codes[np.repeat(offsets[:-1], lengths) + position]
+
+    return torch.from_numpy(features), (torch.from_numpy(lengths) if packed else None)
+
+def predict_batch(model, names, vocab, labels, k=1, seq_length=SEQ_LENGTH, packed=PACKED):
+    '''Classify names in one forward pass.
+    -------------------------
+    Parameters:
+    model       : Trained classifier in eval mode (NameRNN, NameLSTM or NameGRU).
+    names       : Names to classify (list of str).
+    vocab       : Map char to int (Vocab).
+    labels      : Class names in output order (list of str).
+    k           : Number of most probable labels per name (int).
+    seq_length  : Padded name length, same as training (int).
+    packed      : Model was trained on packed sequences (bool).
+
+    Returns top k labels (list of list of str) and their probabilities
+    (np.ndarray of shape (len(names), k)), most probable first.
+    '''
+
+    device = next(model.parameters()).device
+    feature, lengths = encode_batch(names, vocab, seq_length, packed)
+
+    with torch.no_grad():
+        # probabilities in fp32 even if the model runs in bf16
+        prob = torch.softmax(model(feature.to(device), lengths).float(), dim=1)
+        top_prob, top_id = torch.topk(prob, min(k, prob.shape[1]), dim=1)
+
+    return [[labels[i] for i in row] for row in top_id.tolist()], top_prob.cpu().numpy()
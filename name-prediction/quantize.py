@@ -0,0 +1,119 @@
+import io
+import json
+import time
+import argparse
+import statistics
+import random
+import numpy as np
+import torch
+from torch import nn
+from constant import DATA_PATH, HID_SIZE, EMB_SIZE, MODEL_PATH, QUANT_MODEL_PATH, PACKED, CHECKPOINT_DIR
+from network import NameRNN, NameLSTM, NameGRU
+
+NETWORKS = {'RNN': NameRNN, 'LSTM': NameLSTM, 'GRU': NameGRU}
+
+def quantize(model):
+    '''Dynamically quantize LSTM, GRU and Linear layers weights to int8.
+    Quantized models only run on CPU. nn.RNN has no dynamic quantized kernel,
+    so NameRNN only gets its output layer quantized.
+    '''
+
+    model = model.cpu().eval()
+    return torch.ao.quantization.quantize_dynamic(model, {nn.LSTM, nn.GRU, nn.Linear}, dtype=torch.qint8)
+
+def load_quantized(model, path):
+    '''Load int8 checkpoint written by this module into fp32 model instance.'''
+
+    qmodel = quantize(model)
+    # quantized packed weights are not plain tensors, so weights_only can't be used
+    qmodel.load_state_dict(torch.load(path, map_location='cpu', weights_only=False))
+    qmodel.eval()
+
+    return qmodel
+
+def model_size(model):
+    # serialized state_dict size in bytes
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+def latency(fn, repeat=50, warmup=5):
+    # median wall clock time of fn in milliseconds
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(times)
+
+def report(fp32_model, int8_model, test_loader):
+    '''Compare test accuracy, loss, size and forward latency of fp32 and int8 model.'''
+
+    # imported here so quantize/load_quantized stay light for inference
+    from train import test
+
+    # take one batch of test set to measure latency, lengths if packed
+    batch = next(iter(test_loader))
+    feature, lengths = batch[0], (batch[2] if len(batch) > 2 else None)
+
+    result = {}
+    for name, model in (('fp32', fp32_model.cpu().eval()), ('int8', int8_model)):
+        acc, loss = test(model, test_loader)
+
+        with torch.no_grad():
+            result[name] = {
+                'test_acc': acc,
+                'test_loss': loss,
+                'size_bytes': model_size(model),
+                'single_ms': latency(lambda: model(feature[:1], lengths[:1] if lengths is not None else None)),
+                'batch_ms': latency(lambda: model(feature, lengths)),
+            }
+
+    result['speedup'] = {k: result['fp32'][k] / result['int8'][k] for k in ('single_ms', 'batch_ms')}
+    result['batch_size'] = len(feature)
+
+    return result
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Quantize trained name classifier to int8 and report accuracy and latency.')
+    parser.add_argument('--model', choices=list(NETWORKS), default='RNN')
+    parser.add_argument('--checkpoint', help='Trained fp32 state_dict, default to MODEL_PATH of the model.')
+    parser.add_argument('--out', help='Output path, default to QUANT_MODEL_PATH of the model.')
+    parser.add_argument('--seed', type=int, help='Seed of the training run, default to the seed of its latest checkpoint.')
+    args = parser.parse_args()
+
+    # test set is only held out with the seed of the training run
+    from checkpoint import training_seed
+    seed = args.seed if args.seed is not None else training_seed(CHECKPOINT_DIR.format(args.model))
+    if seed is None:
+        parser.error('Training seed unknown, pass --seed.')
+
+    checkpoint = args.checkpoint or MODEL_PATH.format(args.model)
+    out = args.out or QUANT_MODEL_PATH.format(args.model)
+
+    # load data, vocab and labels
+    print('Load and generate DataLoader...')
+    from dataloader import load
+
+    # same shuffle and split as main.py with this seed
+    random.seed(seed)
+    np.random.seed(seed)
+    (_, test_loader, _), vocab, labels = load(DATA_PATH, packed=PACKED)
+
+    # define network and apply checkpoint
+    print('Apply checkpoints to model...')
+    model = NETWORKS[args.model](len(vocab), len(labels), HID_SIZE, EMB_SIZE)
+    model.load_state_dict(torch.load(checkpoint, map_location='cpu'))
+
+    print(f'Quantize model to {out}')
+    qmodel = quantize(model)
+    torch.save(qmodel.state_dict(), out)
+
+    result = report(model, qmodel, test_loader)
+    print(json.dumps(result, indent=2))
+    json.dump(result, open(out.replace('.pt', '.json'), 'w'), indent=2)
@@ -0,0 +1,175 @@
+'''Non-interactive hyperparameter sweep for the name classifier.
+
+Trials run concurrently in a process pool, each limited to its own number
+of torch threads. A trial is pruned when its validation loss is worse than
+the median of the other trials at the same epoch. Every trial writes its
+best checkpoint and training log, and the results table and loss curves go to --out.
+
+    python sweep.py --search grid --workers 4 --epochs 20
+    python sweep.py --search random --trials 20 --workers 4
+'''
+import os
+import csv
+import json
+import time
+import random
+import argparse
+import itertools
+import statistics
+import multiprocessing as mp
+from contextlib import redirect_stdout, redirect_stderr
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from constant import DATA_PATH, GRAD_CLIP, PACKED
+
+# search space, every trial picks one value of each key
+SPACE = {
+    'model': ['RNN', 'LSTM', 'GRU'],
+    'hid_size': [64, 128, 256],
+    'emb_size': [32, 64],
+    'lr': [1e-3, 3e-4, 1e-4],
+    'batch_size': [32, 64, 128]
+}
+
+def grid_search(space):
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*space.values())]
+
+def random_search(space, n_trials, seed=None):
+    rng = random.Random(seed)
+    return [{k: rng.choice(v) for k, v in space.items()} for _ in range(n_trials)]
+
+def should_prune(curves, trial_id, epoch, min_trials=3, warmup=2):
+    '''Median stopping rule: prune trial if its validation loss at epoch is
+    worse than the median of other trials that reached the same epoch.'''
+
+    if epoch < warmup:
+        return False
+
+    others = [c[epoch] for t, c in curves.items() if t != trial_id and len(c) > epoch]
+    if len(others) < min_trials:
+        return False
+
+    return curves[trial_id][epoch] > statistics.median(others)
+
+def init_worker(threads):
+    # limit threads of every trial so concurrent trials don't oversubscribe cores
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+def run_trial(trial_id, params, epochs, out_dir, curves, min_trials, seed):
+    # heavy imports stay in the worker process
+    import numpy as np
+    import torch
+    from network import NameRNN, NameLSTM, NameGRU
+    from dataloader import load
+    from train import train
+
+    networks = {'RNN': NameRNN, 'LSTM': NameLSTM, 'GRU': NameGRU}
+
+    start = time.time()
+
+    # same sweep seed in every trial, so all trials train and validate on the
+    # same split (and batches) and their val losses can be compared
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    (train_loader, _, val_loader), vocab, labels = load(DATA_PATH, packed=PACKED, batch_size=params['batch_size'])
+    network = networks[params['model']](len(vocab), len(labels), params['hid_size'], params['emb_size'])
+    save_path = os.path.join(out_dir, f'trial{trial_id}.pt')
+
+    pruned = False
+
+    def report(e, history):
+        nonlocal pruned
+
+        # share curve with the other trials, then compare against them
+        curves[trial_id] = list(history['val_loss'])
+        pruned = should_prune(dict(curves), trial_id, e, min_trials)
+        return pruned
+
+    # keep training logs of each trial in its own file
+    log_path = os.path.join(out_dir, f'trial{trial_id}.log')
+    with open(log_path, 'w') as log, redirect_stdout(log), redirect_stderr(log):
+        _, history = train(network, train_loader, val_loader, epochs, params['lr'], epochs, GRAD_CLIP, save_path, callback=report)
+
+    return {
+        'trial': trial_id,
+        **params,
+        'best_val_loss': min(history['val_loss']),
+        'best_val_acc': max(history['val_acc']),
+        'epochs': len(history['val_loss']),
+        'pruned': pruned,
+        'seconds': round(time.time() - start, 2),
+        'checkpoint': save_path,
+        'log': log_path,
+        'val_loss': history['val_loss']
+    }
+
+def sweep(trials, epochs=20, workers=2, threads=None, out_dir='./models/sweep', min_trials=3, seed=0):
+    '''Run trials concurrently and write results table and curves to out_dir.
+    Every trial uses seed for its data split, batch order and initial weights.'''
+
+    os.makedirs(out_dir, exist_ok=True)
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+
+    # build vocab and compiled data once, before trials read them concurrently
+    from dataloader import load
+    load(DATA_PATH, packed=PACKED)
+
+    # worker processes inherit environment, set thread limit before they import torch
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+
+    results = []
+    ctx = mp.get_context('spawn')
+    with ctx.Manager() as manager, ProcessPoolExecutor(workers, mp_context=ctx, initializer=init_worker, initargs=(threads,)) as pool:
+        curves = manager.dict()
+        futures = [pool.submit(run_trial, i, params, epochs, out_dir, curves, min_trials, seed) for i, params in enumerate(trials)]
+
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(f"Trial {result['trial']} | {result['model']} hid={result['hid_size']} emb={result['emb_size']} "
+                  f"lr={result['lr']} bs={result['batch_size']} | Best Val Loss: {result['best_val_loss']:.4f} Acc: {result['best_val_acc']:.4f}"
+                  f"{' (pruned)' if result['pruned'] else ''}")
+
+    results.sort(key=lambda r: r['best_val_loss'])
+
+    # write results table and curves
+    columns = ['trial', *trials[0], 'best_val_loss', 'best_val_acc', 'epochs', 'pruned', 'seconds', 'checkpoint', 'log']
+    with open(os.path.join(out_dir, 'results.csv'), 'w', newline='') as w:
+        writer = csv.DictWriter(w, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
+    with open(os.path.join(out_dir, 'curves.json'), 'w') as w:
+        json.dump({'seed': seed, 'curves': {r['trial']: r['val_loss'] for r in results}}, w)
+
+    return results
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run hyperparameter sweep for the name classifier.')
+    parser.add_argument('--search', choices=['grid', 'random'], default='random')
+    parser.add_argument('--trials', type=int, default=10, help='Number of random trials.')
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=2, help='Concurrent trials.')
+    parser.add_argument('--threads', type=int, help='Torch threads per trial, default to cores / workers.')
+    parser.add_argument('--min-trials', type=int, default=3, help='Trials needed at an epoch before pruning.')
+    parser.add_argument('--space', help='JSON file overriding the search space.')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--out', default='./models/sweep')
+    args = parser.parse_args()
+
+    space = SPACE
+    if args.space:
+        with open(args.space) as r:
+            space = {**SPACE, **json.load(r)}
+
+    # one seed for the trial sampling and the data split of every trial
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+    trials = grid_search(space) if args.search == 'grid' else random_search(space, args.trials, seed)
+
+    print(f'Sweep {len(trials)} trials on {args.workers} workers (seed {seed})...')
+    results = sweep(trials, args.epochs, args.workers, args.threads, args.out, args.min_trials, seed)
+    print(f"Best trial {results[0]['trial']}: {results[0]['checkpoint']} ({results[0]['best_val_loss']:.4f})")
@@ -1,12 +1,29 @@
 import torch
 from torch.optim import Adam
 from torch import nn
-from constant import ES, DEVICE, MODEL_PATH
+from constant import ES, DEVICE, MODEL_PATH, BF16
+from instrument import NullMonitor
+from metrics import Metrics
+from checkpoint import rng_state, set_rng_state
+from precision import autocast
 from tqdm import tqdm
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-def train(model, train_loader, val_loader, epochs=500, lr=.001, print_every=100, grad_clip=5, save_path=MODEL_PATH.format('')):
+def unpack_batch(batch):
+    '''Move batch to device, return feature, Long target and lengths
+    (None unless loader is bucketed for packed sequences).'''
+
+    feature, target = batch[0].to(DEVICE), batch[1].type(torch.LongTensor).to(DEVICE)
+    lengths = batch[2] if len(batch) > 2 else None
+
+    return feature, target, lengths
+
+def batch_tokens(feature, lengths):
+    # chars the network steps over, <PAD> excluded for packed batches
+    return int(lengths.sum()) if lengths is not None else feature.numel()
+
+def train(model, train_loader, val_loader, epochs=500, lr=.001, print_every=100, grad_clip=5, save_path=MODEL_PATH.format(''), callback=None, monitor=None, checkpoint=None, resume=None, bf16=BF16):
 
     # dict to store training logs
     history = {
@@ -27,9 +44,23 @@ def train(model, train_loader, val_loader, epochs=500, lr=.001, print_every=100,
     # early stop trigger
     es_trigger = 0
     val_loss_min = torch.inf
+    start_epoch = 0
+
+    # continue from full training state, see checkpoint.CheckpointManager
+    if resume is not None:
+        model.load_state_dict(resume['model'])
+        optim.load_state_dict(resume['optimizer'])
+        es_trigger, val_loss_min = resume['es_trigger'], resume['val_loss_min']
+        history = {**resume['history'], 'epochs': epochs}
+        start_epoch = resume['epoch'] + 1
+        set_rng_state(resume['rng'])
 
     # setup epoch tqdm
-    epochloop = tqdm(range(epochs), position=0, desc='Training...', leave=True)
+    epochloop = tqdm(range(start_epoch, epochs), position=0, desc='Training...', leave=True)
+
+    # records phase timing and throughput, see instrument.TrainingMonitor
+    if monitor is None:
+        monitor = NullMonitor()
 
     for e in epochloop:
 
@@ -38,46 +69,49 @@ def train(model, train_loader, val_loader, epochs=500, lr=.001, print_every=100,
         #################
 
         model.train()
+        monitor.start_epoch()
 
-        # running train loss and acc
-        train_loss = 0
-        train_acc = 0
+        # running train loss and acc, kept on device
+        train_metrics = Metrics()
 
-        for feature, target in train_loader:
-            
-            # convert target type to Long
-            target = target.type(torch.LongTensor)
+        # reshuffle bucketed batches for this epoch
+        if hasattr(train_loader.batch_sampler, 'set_epoch'):
+            train_loader.batch_sampler.set_epoch(e)
 
-            # move to device
-            feature, target = feature.to(DEVICE), target.to(DEVICE)
+        for batch in monitor.timed(train_loader):
+            
+            # move to device, target as Long
+            feature, target, lengths = unpack_batch(batch)
 
             # reset optimizer
             optim.zero_grad()
 
-            # forward pass
-            out = model(feature)
-
-            # compute acc
-            predicted = torch.argmax(out, dim=1) == target
-            acc = torch.mean(predicted.type(torch.FloatTensor))
-            train_acc += acc.item()
+            # forward pass and compute loss, in bf16 if enabled
+            with monitor.phase('forward'), autocast(bf16):
+                out = model(feature, lengths)
+                loss = criterion(out, target)
 
-            # compute loss
-            loss = criterion(out, target)
-            train_loss += loss.item()
+            # record loss and acc
+            train_metrics.update(loss, out, target)
             
             # backpropagate
-            loss.backward()
+            with monitor.phase('backward'):
+                loss.backward()
 
-            # clip grad
-            nn.utils.clip_grad_norm_(model.parameters(), grad_clip)
+            with monitor.phase('optimizer'):
+                # clip grad
+                nn.utils.clip_grad_norm_(model.parameters(), grad_clip)
 
-            # update optimizer
-            optim.step()
+                # update optimizer
+                optim.step()
+
+            monitor.step(e, len(feature), batch_tokens(feature, lengths))
 
         # record train history
-        history['train_loss'].append(train_loss / len(train_loader))
-        history['train_acc'].append(train_acc / len(train_loader))
+        result = train_metrics.compute()
+        train_loss, train_acc = result['loss'], result['acc']
+        history['train_loss'].append(train_loss)
+        history['train_acc'].append(train_acc)
 
 
         ###################
@@ -86,66 +120,85 @@ def train(model, train_loader, val_loader, epochs=500, lr=.001, print_every=100,
 
         model.eval()
 
-        # running val loss and acc
-        val_loss = 0
-        val_acc = 0
+        # running val loss and acc, kept on device
+        val_metrics = Metrics()
 
         # turn off gradient
-        with torch.no_grad():
-            for feature, target in val_loader:
-
-                # convert target type to Long
-                target = target.type(torch.LongTensor)
+        with torch.no_grad(), monitor.phase('validation'), autocast(bf16):
+            for batch in val_loader:
 
-                # move to device
-                feature, target = feature.to(DEVICE), target.to(DEVICE)
+                # move to device, target as Long
+                feature, target, lengths = unpack_batch(batch)
 
                 # forward pass
-                out = model(feature)
-
-                # compute acc
-                predicted = torch.argmax(out, dim=1) == target
-                acc = torch.mean(predicted.type(torch.FloatTensor))
-                val_acc += acc.item()
+                out = model(feature, lengths)
 
-                # compute loss
+                # compute loss and acc
                 loss = criterion(out, target)
-                val_loss += loss.item()
+                val_metrics.update(loss, out, target)
 
         # record validation history
-        history['val_loss'].append(val_loss / len(val_loader))
-        history['val_acc'].append(val_acc / len(val_loader))
+        result = val_metrics.compute()
+        val_loss, val_acc = result['loss'], result['acc']
+        history['val_loss'].append(val_loss)
+        history['val_acc'].append(val_acc)
+        monitor.epoch_end(e, train_loss=history['train_loss'][-1], val_loss=history['val_loss'][-1], val_acc=history['val_acc'][-1])
 
         # reset model mode
         model.train()
 
         # add epoch meta info
-        epochloop.set_postfix_str(f'Val Loss: {val_loss/len(val_loader):.3f}')
+        epochloop.set_postfix_str(f'Val Loss: {val_loss:.3f}')
 
         # print epoch
         if (e+1) % print_every == 0:
-            epochloop.write(f'Epoch {e+1}/{epochs} | Train Loss: {train_loss/len(train_loader):.4f} | Val Loss: {val_loss/len(val_loader):.4f} Acc: {val_acc/len(val_loader):.4f}')
+            epochloop.write(f'Epoch {e+1}/{epochs} | Train Loss: {train_loss:.4f} | Val Loss: {val_loss:.4f} Acc: {val_acc:.4f}')
             epochloop.update()
 
         # save model if validatoin loss decrease
-        if val_loss/len(val_loader) <= val_loss_min:            
-            torch.save(model.state_dict(), save_path)
-            val_loss_min = val_loss/len(val_loader)
+        improved = val_loss <= val_loss_min
+        if improved:
+            # checkpoint manager writes weights in background instead
+            if checkpoint is None:
+                torch.save(model.state_dict(), save_path)
+            val_loss_min = val_loss
             es_trigger = 0
         else:
-            epochloop.write(f'[WARNING] Validation loss not improving ({val_loss_min:.4f} --> {val_loss/len(val_loader):.4f})')
+            epochloop.write(f'[WARNING] Validation loss not improving ({val_loss_min:.4f} --> {val_loss:.4f})')
             es_trigger += 1
 
+        # save everything needed to resume after this epoch
+        if checkpoint is not None:
+            checkpoint.save({
+                'model': model.state_dict(),
+                'optimizer': optim.state_dict(),
+                'epoch': e,
+                'es_trigger': es_trigger,
+                'val_loss_min': val_loss_min,
+                'history': history,
+                'rng': rng_state()
+            }, e, is_best=improved)
+
         # force early stop
         if es_trigger >= ES:
             epochloop.write(f'Early stopped at Epoch-{e}')
             # update epochs history
             history['epochs'] = e+1
             break        
+
+        # stop when callback asks to, e.g. trial pruned by a sweep
+        if callback is not None and callback(e, history):
+            epochloop.write(f'Stopped by callback at Epoch-{e}')
+            history['epochs'] = e+1
+            break
+
+    # finish pending checkpoint write
+    if checkpoint is not None:
+        checkpoint.wait()
     
     return model, history
 
-def test(model, test_loader):
+def test(model, test_loader, return_confusion=False, bf16=BF16):
     ###################
     # validation mode #
     ###################
@@ -155,36 +208,33 @@ def test(model, test_loader):
     # loss function
     criterion = nn.CrossEntropyLoss()
 
-    # test loss and acc
-    test_loss = 0
-    test_acc = 0
+    # test loss, acc and confusion matrix, kept on device
+    test_metrics = Metrics(model.output.out_features)
 
     # setup test_loader tqdm
     testloop = tqdm(test_loader, position=0, leave=True, desc='Inference on test data...')
 
     # turn off gradient
-    with torch.no_grad():
-        for feature, target in testloop:
-
-            # convert target type to Long
-            target = target.type(torch.LongTensor)
+    with torch.no_grad(), autocast(bf16):
+        for batch in testloop:
 
-            # move to device
-            feature, target = feature.to(DEVICE), target.to(DEVICE)
+            # move to device, target as Long
+            feature, target, lengths = unpack_batch(batch)
 
             # forward pass
-            out = model(feature)
-
-            # compute acc
-            predicted = torch.argmax(out, dim=1) == target
-            acc = torch.mean(predicted.type(torch.FloatTensor))
-            test_acc += acc.item()
+            out = model(feature, lengths)
 
-            # compute loss
+            # compute loss and acc
             loss = criterion(out, target)
-            test_loss += loss.item()
+            test_metrics.update(loss, out, target)
+
+    result = test_metrics.compute()
+    print(f"Accuracy: {result['acc']}, Loss: {result['loss']}")
+
+    if return_confusion:
+        return result['acc'], result['loss'], result['confusion']
 
-    print(f'Accuracy: {test_acc/len(test_loader)}, Loss: {test_loss/len(test_loader)}')
+    return result['acc'], result['loss']
 
 def plot_loss(history):
     # history loss
@@ -199,4 +249,16 @@ def plot_loss(history):
     plt.plot(range(history['epochs']), history['train_acc'], label='Train Acc')
     plt.plot(range(history['epochs']), history['val_acc'], label='Val Acc')
     plt.legend()
-    plt.savefig('./plot/acc_history.png', format='png')
\ No newline at end of file
+    plt.savefig('./plot/acc_history.png', format='png')
+
+def plot_confusion(confusion, labels):
+    # confusion matrix normalized per actual class
+    confusion = confusion.float()
+    confusion = confusion / confusion.sum(dim=1, keepdim=True).clamp(min=1)
+
+    plt.figure(figsize=(10, 8))
+    sns.heatmap(confusion.numpy(), xticklabels=labels, yticklabels=labels, cmap='Blues')
+    plt.xlabel('Predicted')
+    plt.ylabel('Actual')
+    plt.tight_layout()
+    plt.savefig('./plot/confusion_matrix.png', format='png')
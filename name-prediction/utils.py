@@ -1,5 +1,11 @@
 import torch
 
 def output_to_label(labels, output):
-    label_id = torch.argmax(output).item()
-    return label_id, labels[label_id]
\ No newline at end of file
+    # argmax per row, output is (num_classes) or (batch_size, num_classes)
+    label_id = torch.argmax(output, dim=-1)
+
+    if label_id.dim() == 0:
+        return label_id.item(), labels[label_id.item()]
+
+    label_id = label_id.tolist()
+    return label_id, [labels[i] for i in label_id]
\ No newline at end of file
@@ -0,0 +1,96 @@
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+
+VOCAB_VERSION = 1
+PAD = '<PAD>'
+
+class Vocab(dict):
+    '''Character vocabulary, maps char to int like the plain dict it replaces.
+    Index 0 is <PAD> and chars follow from index 1 in the given order, so the
+    same chars always get the same indices on every process and node.
+    -------------------------
+    Parameters:
+    chars   : Characters in index order, <PAD> excluded (list of str).
+    '''
+
+    def __init__(self, chars):
+        super(Vocab, self).__init__({PAD: 0})
+        self.update({ch: i for i, ch in enumerate(chars, 1)})
+
+        # map int to char
+        self.int2char = {i: ch for ch, i in self.items()}
+        self.chars = list(chars)
+
+        # lookup table from unicode code point to index, -1 for unknown chars
+        self.table = np.full(max([ord(ch) for ch in chars] + [0]) + 1, -1, dtype=np.int32)
+        self.table[[ord(ch) for ch in chars]] = np.arange(1, len(chars) + 1)
+
+    @classmethod
+    def build(cls, names):
+        # sorted chars, so indices never depend on set order
+        return cls(sorted(set(''.join(names))))
+
+    @classmethod
+    def from_char2int(cls, char2int):
+        # keep indices of an existing char2int dict (e.g. legacy vocab.pkl)
+        return cls([ch for ch, i in sorted(char2int.items(), key=lambda x: x[1]) if i > 0])
+
+    @property
+    def fingerprint(self):
+        return hashlib.sha1(json.dumps(self.chars).encode('utf-8')).hexdigest()
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as w:
+            json.dump({'version': VOCAB_VERSION, 'pad': PAD, 'chars': self.chars,
+                       'fingerprint': self.fingerprint}, w, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as r:
+            data = json.load(r)
+
+        if data.get('version') != VOCAB_VERSION:
+            raise ValueError(f'Unsupported vocab version: {data.get("version")}')
+
+        return cls(data['chars'])
+
+    def encode_code_points(self, code_points):
+        '''Encode unicode code points (1D uint32 array) to indices (1D uint16 array).'''
+
+        codes = np.full(len(code_points), -1, dtype=np.int32)
+        known = code_points < len(self.table)
+        codes[known] = self.table[code_points[known]]
+
+        if (codes < 0).any():
+            unknown = sorted(chr(cp) for cp in np.unique(code_points[codes < 0]))
+            raise KeyError(f'Characters not in vocabulary: {unknown}')
+
+        return codes.astype(np.uint16)
+
+    def encode(self, names):
+        '''Encode list of names at once.
+        Returns flat codes and offsets, name i is codes[offsets[i]:offsets[i+1]].
+        '''
+
+        # every char as its code point, utf-32 has fixed 4 bytes per char
+        code_points = np.frombuffer(''.join(names).encode('utf-32-le'), dtype=np.uint32)
+        offsets = np.concatenate(([0], np.cumsum([len(name) for name in names]))).astype(np.int64)
+
+        return self.encode_code_points(code_points), offsets
+
+def load_vocab(path, legacy_path='./models/vocab.pkl'):
+    '''Load vocab from path. A legacy pickled char2int dict is converted
+    (keeping its indices, so old checkpoints still match) and saved to path.
+    Raises FileNotFoundError if neither exists.
+    '''
+
+    if os.path.exists(path):
+        return Vocab.load(path)
+
+    vocab = Vocab.from_char2int(pickle.load(open(legacy_path, 'rb')))
+    vocab.save(path)
+
+    return vocab